@@ -0,0 +1,49 @@
+import asyncio
+
+
+class WebSocketClient:
+    # Talks the ASGI websocket protocol to an app in the same event loop: no server,
+    # no network, so many thousands of sockets cost only their queues and one task.
+    def __init__(self, app, path: str):
+        self.app = app
+        self.scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "scheme": "ws",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "headers": [(b"host", b"testserver")],
+            "client": ("127.0.0.1", 0),
+            "server": ("testserver", 80),
+            "subprotocols": [],
+        }
+        self.close_code: int | None = None
+        self._to_app: asyncio.Queue[dict] = asyncio.Queue()
+        self._from_app: asyncio.Queue[dict] = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+
+    async def connect(self):
+        self._to_app.put_nowait({"type": "websocket.connect"})
+        self._task = asyncio.create_task(self.app(self.scope, self._to_app.get, self._from_app.put))
+        message = await self._from_app.get()
+        if message["type"] != "websocket.accept":
+            raise ConnectionError(f"{self.scope['path']} refused the connection: {message}")
+
+    async def send_text(self, text: str):
+        await self._to_app.put({"type": "websocket.receive", "text": text})
+
+    async def receive_text(self) -> str:
+        message = await self._from_app.get()
+        if message["type"] == "websocket.close":
+            self.close_code = message.get("code", 1000)
+            raise ConnectionError(f"{self.scope['path']} closed with {self.close_code}")
+        return message["text"]
+
+    def pending(self) -> int:
+        return self._from_app.qsize()
+
+    async def close(self, code: int = 1000):
+        await self._to_app.put({"type": "websocket.disconnect", "code": code})
+        await self._task
@@ -0,0 +1,83 @@
+"""Requests/sec of the sync (main.py) and async (main_async.py) heroes API under concurrency.
+
+Run from the directory that contains the repo:
+    python -m <repo>.benchmarks.async_vs_sync --concurrency 64 --requests 2000
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from sqlmodel import Session, SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .. import main, main_async
+from ..engines import async_sqlite_engine, sqlite_engine
+from ..seed import seed_main
+
+
+async def run_load(app, paths: list[str], concurrency: int, requests: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        remaining = iter(range(requests))
+
+        async def worker():
+            for i in remaining:
+                response = await client.get(paths[i % len(paths)])
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return requests / (time.perf_counter() - start)
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--heroes", type=int, default=10_000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=2_000)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.db"
+        engine = sqlite_engine(f"sqlite:///{path}", pool_size=args.concurrency)
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as session:
+            seed_main(session, main, heroes=args.heroes, rng=random.Random(0))
+            session.commit()
+        async_engine = async_sqlite_engine(f"sqlite+aiosqlite:///{path}", pool_size=args.concurrency)
+
+        def get_session_override():
+            with Session(engine) as session:
+                yield session
+
+        async def get_async_session_override():
+            async with AsyncSession(async_engine, expire_on_commit=False) as session:
+                yield session
+
+        main.app.dependency_overrides[main.get_session] = get_session_override
+        main_async.app.dependency_overrides[main_async.get_session] = get_async_session_override
+        # the routes main_async borrows from main.py open sync sessions
+        main_async.app.dependency_overrides[main.get_session] = get_session_override
+
+        rng = random.Random(1)
+        paths = [f"/heroes/?limit={args.limit}&offset={rng.randrange(args.heroes)}" for _ in range(50)]
+        paths += [f"/heroes/{rng.randint(1, args.heroes)}" for _ in range(50)]
+
+        print(f"heroes={args.heroes} concurrency={args.concurrency} requests={args.requests}")
+        for name, app in [("sync", main.app), ("async", main_async.app)]:
+            # neither run may be served bodies the other one cached
+            main.response_cache.clear()
+            rate = asyncio.run(run_load(app, paths, args.concurrency, args.requests))
+            print(f"{name:>5}: {rate:8.1f} req/s")
+
+        asyncio.run(async_engine.dispose())
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,75 @@
+"""Substring search over hero names: LIKE '%term%' vs the FTS5 trigram index.
+
+Run from the directory that contains the repo:
+    python -m <repo>.benchmarks.fulltext_search --rows 1000000
+"""
+import argparse
+import random
+import statistics
+import string
+import tempfile
+import time
+from pathlib import Path
+
+from sqlmodel import Session, SQLModel, col, or_, select
+
+from .. import main
+from ..engines import sqlite_engine
+from ..main import Hero, hero_search
+from ..seed import seed_main
+
+
+def like_statement(term: str):
+    pattern = f"%{term}%"
+    return select(Hero).where(or_(col(Hero.name).like(pattern), col(Hero.secret_name).like(pattern)))
+
+
+def fts_statement(term: str):
+    return hero_search.search(select(Hero), Hero.id, term)
+
+
+def measure(engine, build, terms: list[str], limit: int) -> tuple[float, float]:
+    timings, found = [], []
+    for term in terms:
+        with Session(engine) as session:
+            start = time.perf_counter()
+            heroes = session.exec(build(term).limit(limit)).all()
+            timings.append(time.perf_counter() - start)
+        found.append(len(heroes))
+    return statistics.median(timings) * 1000, statistics.mean(found)
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--terms", type=int, default=20)
+    # with short terms a page fills early and LIMIT cuts the LIKE scan short
+    parser.add_argument("--term-length", type=int, default=4)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    alphabet = string.ascii_uppercase + string.digits
+    terms = ["".join(rng.choices(alphabet, k=args.term_length)) for _ in range(args.terms)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = sqlite_engine(f"sqlite:///{Path(tmp) / 'bench.db'}", pool_size=2)
+        # create_all also builds the FTS table; its triggers index rows as they go in
+        SQLModel.metadata.create_all(engine)
+        start = time.perf_counter()
+        with Session(engine) as session:
+            seed_main(session, main, heroes=args.rows, rng=rng)
+            session.commit()
+        elapsed = time.perf_counter() - start
+        print(f"rows={args.rows} term length={args.term_length} seeded and indexed in {elapsed:.1f}s")
+
+        like_ms, like_found = measure(engine, like_statement, terms, args.limit)
+        fts_ms, fts_found = measure(engine, fts_statement, terms, args.limit)
+        print(f"LIKE: {like_ms:8.2f} ms median, {like_found:.1f} rows per term")
+        print(f"FTS5: {fts_ms:8.2f} ms median, {fts_found:.1f} rows per term (ranked)")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main_()
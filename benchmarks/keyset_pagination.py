@@ -0,0 +1,79 @@
+"""Page-1000 latency of offset vs cursor paging on GET /heroes/.
+
+Run from the directory that contains the repo:
+    python -m <repo>.benchmarks.keyset_pagination --rows 200000
+"""
+import argparse
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+from sqlmodel import Session, SQLModel, create_engine
+
+from ..keyset import encode_cursor
+from ..main import City, Hero, Region, Team, app, get_session
+
+
+def build_database(path: Path, rows: int):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.execute(insert(Region), [{"id": 1, "name": "Texas"}])
+        session.execute(insert(City), [{"id": 1, "name": "Austin", "region_id": 1}])
+        session.execute(insert(Team), [{"id": 1, "name": "X-men", "headquarters": "House"}])
+        session.execute(
+            insert(Hero),
+            [
+                {"name": f"hero-{i:08}", "secret_name": "S", "age": i % 90, "team_id": 1, "city_id": 1}
+                for i in range(rows)
+            ],
+        )
+        session.commit()
+    return engine
+
+
+def measure(client: TestClient, params: dict, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get("/heroes/", params=params)
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200 and len(response.json()) == params["limit"]
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=120_000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--page", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = build_database(Path(tmp) / "bench.db", args.rows)
+
+        def get_session_override():
+            with Session(engine) as session:
+                yield session
+
+        app.dependency_overrides[get_session] = get_session_override
+        client = TestClient(app)
+        skipped = args.limit * (args.page - 1)
+
+        offset_ms = measure(client, {"limit": args.limit, "offset": skipped}, args.repeat)
+        # the cursor a client holds after reading page - 1 in id order
+        cursor = encode_cursor(["id", None, skipped])
+        cursor_ms = measure(client, {"limit": args.limit, "cursor": cursor}, args.repeat)
+
+        print(f"rows={args.rows} page={args.page} limit={args.limit}")
+        print(f"offset: {offset_ms:8.2f} ms (median of {args.repeat})")
+        print(f"cursor: {cursor_ms:8.2f} ms (median of {args.repeat})")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""GET /heroes/ and /teams/ latency with and without the HEROES_FAST_JSON path.
+
+Run from the directory that contains the repo:
+    python -m <repo>.benchmarks.list_serialization --heroes 20000 --repeat 50
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+from sqlmodel import Session, SQLModel
+
+from .. import config, main
+from ..engines import sqlite_engine
+from ..seed import seed_main
+
+
+def measure(client: TestClient, url: str, params: dict, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get(url, params=params)
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200
+    return statistics.median(timings) * 1000
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--heroes", type=int, default=20_000)
+    parser.add_argument("--teams", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = sqlite_engine(f"sqlite:///{Path(tmp) / 'bench.db'}", pool_size=4)
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as session:
+            seed_main(session, main, heroes=args.heroes, teams=args.teams, rng=random.Random(args.seed))
+            session.commit()
+
+        def get_session_override():
+            with Session(engine) as session:
+                yield session
+
+        main.app.dependency_overrides[main.get_session] = get_session_override
+        client = TestClient(main.app)
+        heroes_per_team = args.heroes // args.teams
+        cases = [
+            ("/heroes/", {"limit": 100}, "100 nested heroes"),
+            ("/teams/", {"limit": 10}, f"10 teams x ~{heroes_per_team} heroes"),
+        ]
+        print(f"heroes={args.heroes} teams={args.teams} (median of {args.repeat})")
+        for url, params, label in cases:
+            config.FAST_JSON = False
+            validated = measure(client, url, params, args.repeat)
+            config.FAST_JSON = True
+            fast = measure(client, url, params, args.repeat)
+            print(f"{label:>28}: validated {validated:7.2f} ms  fast {fast:7.2f} ms  ({validated / fast:.1f}x)")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main_()
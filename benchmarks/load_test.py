@@ -0,0 +1,292 @@
+"""Latency percentiles and throughput per endpoint of all four apps, as JSON.
+
+Every app runs in-process (httpx's ASGI transport, a raw ASGI client for the chat
+websocket) against a freshly seeded temporary database, so runs are repeatable and
+comparable over time. main.py and pagination.py map the same hero table, so with
+--app all each app is measured in its own subprocess and the reports are merged.
+
+Run from the directory that contains the repo:
+    python -m <repo>.benchmarks.load_test --rows 100000 --output baseline.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from contextlib import asynccontextmanager
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+import httpx
+from sqlalchemy import insert
+from sqlmodel import Session, SQLModel
+
+from ..engines import async_sqlite_engine, sqlite_engine
+from ..seed import id_generator, insert_batched, seed_main, seed_pagination
+from ..asgi_websocket import WebSocketClient
+
+
+class Scenario:
+    # One endpoint under load. path and body draw each request's arguments from the
+    # run's random generator, so a seed reproduces the exact request sequence.
+    def __init__(
+        self,
+        name: str,
+        path: Callable[[random.Random], str],
+        *,
+        method: str = "GET",
+        body: Callable[[random.Random], dict] | None = None,
+    ):
+        self.name = name
+        self.path = path
+        self.method = method
+        self.body = body
+
+
+def hero_body(rng: random.Random) -> dict:
+    return {"name": id_generator(rng=rng), "secret_name": id_generator(rng=rng), "age": rng.randint(0, 100)}
+
+
+# The app modules are imported inside these: main and pagination cannot be loaded
+# into one process. Each yields the app and its scenarios, with the module's engine
+# pointed at the seeded database.
+
+
+@asynccontextmanager
+async def main_app(database: Path, rows: int, rng: random.Random):
+    from .. import main
+
+    engine = sqlite_engine(f"sqlite:///{database}", pool_size=40)
+    SQLModel.metadata.create_all(engine)
+    teams, cities = max(1, rows // 100), 20
+    with Session(engine) as session:
+        seed_main(session, main, heroes=rows, teams=teams, cities=cities, rng=rng)
+        session.commit()
+    main.engine = engine
+
+    def member_body(r: random.Random) -> dict:
+        return {**hero_body(r), "team_id": r.randint(1, teams), "city_id": r.randint(1, cities)}
+
+    yield main.app, [
+        Scenario("GET /heroes/", lambda r: f"/heroes/?limit=20&offset={r.randrange(rows)}"),
+        Scenario("GET /heroes/ (filtered)", lambda r: f"/heroes/?team_id={r.randint(1, teams)}&min_age=50&limit=20"),
+        Scenario("GET /heroes/{hero_id}", lambda r: f"/heroes/{r.randint(1, rows)}"),
+        Scenario("GET /heroes/search", lambda r: f"/heroes/search?q={id_generator(3, rng=r)}"),
+        Scenario("GET /teams/", lambda r: f"/teams/?limit=10&offset={r.randrange(teams)}"),
+        Scenario("GET /teams/{team_id}", lambda r: f"/teams/{r.randint(1, teams)}"),
+        Scenario("POST /heroes/", lambda r: "/heroes/", method="POST", body=member_body),
+    ]
+    engine.dispose()
+
+
+@asynccontextmanager
+async def pagination_app(database: Path, rows: int, rng: random.Random):
+    from .. import pagination
+
+    engine = sqlite_engine(f"sqlite:///{database}", pool_size=40)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        seed_pagination(session, pagination, heroes=rows, rng=rng)
+        session.commit()
+    pagination.engine = engine
+    pages = max(1, rows // 20)
+    yield pagination.app, [
+        Scenario("GET /heroes/", lambda r: f"/heroes/?page={r.randint(1, pages)}&per-page=20"),
+        Scenario("GET /heroes/ (filtered)", lambda r: f"/heroes/?name_prefix={id_generator(2, rng=r)}&per-page=20"),
+        Scenario("GET /heroes/{hero_id}", lambda r: f"/heroes/{r.randint(1, rows)}"),
+        Scenario("POST /heroes/", lambda r: "/heroes/", method="POST", body=hero_body),
+    ]
+    engine.dispose()
+
+
+@asynccontextmanager
+async def fastcrud_app(database: Path, rows: int, rng: random.Random):
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    from .. import fastcrud
+    from ..models import Base, Item
+
+    engine = async_sqlite_engine(f"sqlite+aiosqlite:///{database}", pool_size=20)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+        items = [{"name": id_generator(rng=rng), "description": id_generator(rng=rng)} for _ in range(rows)]
+        await connection.execute(insert(Item), items)
+
+    async def get_session_override():
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            yield session
+
+    def item_body(r: random.Random) -> dict:
+        return {"name": id_generator(rng=r), "description": id_generator(rng=r)}
+
+    fastcrud.app.dependency_overrides[fastcrud.get_session] = get_session_override
+    yield fastcrud.app, [
+        Scenario("GET /items/list", lambda r: f"/items/list?offset={r.randrange(rows)}&limit=20"),
+        Scenario("GET /items/fetch/{id}", lambda r: f"/items/fetch/{r.randint(1, rows)}"),
+        Scenario("POST /items/add", lambda r: "/items/add", method="POST", body=item_body),
+        Scenario("PATCH /items/modify/{id}", lambda r: f"/items/modify/{r.randint(1, rows)}", method="PATCH", body=item_body),
+    ]
+    fastcrud.app.dependency_overrides.clear()
+    await engine.dispose()
+
+
+@asynccontextmanager
+async def websocket_app(database: Path, rows: int, rng: random.Random):
+    from .. import websocket
+
+    engine = sqlite_engine(f"sqlite:///{database}", pool_size=10)
+    SQLModel.metadata.create_all(engine)
+    # rows heartbeats from 100 users, a minute apart
+    users = max(1, min(100, rows))
+    start = datetime(2024, 1, 1, tzinfo=UTC)
+    messages = (
+        {"datetime": start + timedelta(seconds=60 * (i // users) + rng.random()), "user_id": i % users + 1}
+        for i in range(rows)
+    )
+    with Session(engine) as session:
+        insert_batched(session, websocket.WebsocketMessage, messages)
+        websocket.rebuild_activity(session)
+        session.commit()
+    websocket.engine = engine
+    websocket.message_buffer.engine = engine
+    websocket.message_buffer.start()
+    yield websocket.app, [
+        Scenario("GET /activity", lambda r: f"/activity?offset={r.randrange(users)}&limit=20"),
+        Scenario("GET /activity/{user_id}", lambda r: f"/activity/{r.randint(1, users)}"),
+        Scenario("GET /activity/{user_id} (window)", lambda r: f"/activity/{r.randint(1, users)}?incremental=false"),
+        Scenario("GET /stats", lambda r: "/stats"),
+        Scenario("WS /ws/{client_id} echo", lambda r: "/ws/", method="WS"),
+    ]
+    await websocket.message_buffer.stop()
+    websocket.db.shutdown()
+    engine.dispose()
+
+
+APPS = {"main": main_app, "pagination": pagination_app, "fastcrud": fastcrud_app, "websocket": websocket_app}
+
+
+def summarize(timings: list[float], errors: int, elapsed: float) -> dict:
+    # ms; quantiles needs two points, a single request is every percentile
+    cuts = statistics.quantiles(timings, n=100, method="inclusive") if len(timings) > 1 else timings * 99
+    return {
+        "requests": len(timings),
+        "errors": errors,
+        "throughput_rps": round(len(timings) / elapsed, 1),
+        "mean_ms": round(statistics.fmean(timings) * 1000, 3),
+        "p50_ms": round(cuts[49] * 1000, 3),
+        "p95_ms": round(cuts[94] * 1000, 3),
+        "p99_ms": round(cuts[98] * 1000, 3),
+    }
+
+
+async def run_http(client: httpx.AsyncClient, scenario: Scenario, requests: int, concurrency: int, rng) -> dict:
+    # arguments are drawn before the clock starts
+    calls = [(scenario.path(rng), scenario.body(rng) if scenario.body else None) for _ in range(requests)]
+    pending = iter(calls)
+    timings: list[float] = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for path, body in pending:
+            start = time.perf_counter()
+            response = await client.request(scenario.method, path, json=body)
+            timings.append(time.perf_counter() - start)
+            errors += response.status_code >= 400
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(timings, errors, time.perf_counter() - start)
+
+
+async def run_websocket(app, scenario: Scenario, requests: int, concurrency: int, rng) -> dict:
+    # concurrency sockets, each sending its share of heartbeats and timing the echo
+    path = scenario.path(rng)
+    sockets = [WebSocketClient(app, f"{path}{client_id}") for client_id in range(1, concurrency + 1)]
+    for socket in sockets:
+        await socket.connect()
+    timings: list[float] = []
+
+    async def chat(socket: WebSocketClient, count: int):
+        for _ in range(count):
+            start = time.perf_counter()
+            await socket.send_text("Track time")
+            while not (await socket.receive_text()).startswith("You wrote:"):
+                pass
+            timings.append(time.perf_counter() - start)
+
+    share, extra = divmod(requests, concurrency)
+    start = time.perf_counter()
+    await asyncio.gather(*(chat(socket, share + (i < extra)) for i, socket in enumerate(sockets)))
+    elapsed = time.perf_counter() - start
+    for socket in sockets:
+        await socket.close()
+    return summarize(timings, 0, elapsed)
+
+
+async def measure_app(name: str, args) -> dict:
+    rng = random.Random(args.seed)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        async with APPS[name](Path(tmp) / "bench.db", args.rows, rng) as (app, scenarios):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                for scenario in scenarios:
+                    for count in [args.warmup, args.requests] if args.warmup else [args.requests]:
+                        if scenario.method == "WS":
+                            result = await run_websocket(app, scenario, count, args.concurrency, rng)
+                        else:
+                            result = await run_http(client, scenario, count, args.concurrency, rng)
+                    results[scenario.name] = result
+    return results
+
+
+def measure_in_subprocess(name: str, args) -> dict:
+    command = [sys.executable, "-m", __spec__.name, "--app", name, "--rows", str(args.rows)]
+    command += ["--requests", str(args.requests), "--concurrency", str(args.concurrency)]
+    command += ["--warmup", str(args.warmup), "--seed", str(args.seed)]
+    output = subprocess.run(command, stdout=subprocess.PIPE, check=True, text=True).stdout
+    return json.loads(output)["apps"][name]
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", choices=[*APPS, "all"], default="all")
+    parser.add_argument("--rows", type=int, default=10_000, help="seeded rows per app")
+    parser.add_argument("--requests", type=int, default=1_000, help="timed requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=50, help="untimed requests per endpoint")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="write the report here instead of stdout")
+    args = parser.parse_args()
+
+    report = {
+        "started_at": datetime.now(UTC).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "rows": args.rows,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "seed": args.seed,
+    }
+    if args.app == "all":
+        report["apps"] = {name: measure_in_subprocess(name, args) for name in APPS}
+    else:
+        report["apps"] = {args.app: asyncio.run(measure_app(args.app, args))}
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main_()
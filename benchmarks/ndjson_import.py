@@ -0,0 +1,127 @@
+"""Throughput and peak memory of POST /heroes/import on a generated NDJSON file.
+
+Run from the directory that contains the repo:
+    python -m <repo>.benchmarks.ndjson_import --rows 1000000
+"""
+import argparse
+import asyncio
+import json
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from sqlalchemy import func, insert
+from sqlmodel import Session, SQLModel, select
+
+from ..engines import sqlite_engine
+from ..main import City, Hero, Region, Team, app, get_session
+
+CHUNK_BYTES = 64 * 1024
+
+
+def build_database(path: Path, teams: int, cities: int):
+    engine = sqlite_engine(f"sqlite:///{path}", pool_size=4)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.execute(insert(Region), [{"id": 1, "name": "Texas"}])
+        session.execute(insert(City), [{"name": f"City {i}", "region_id": 1} for i in range(cities)])
+        session.execute(insert(Team), [{"name": f"Team {i}", "headquarters": "HQ"} for i in range(teams)])
+        session.commit()
+    return engine
+
+
+def write_file(path: Path, rows: int, teams: int, cities: int, rng: random.Random):
+    with path.open("w") as file:
+        for i in range(rows):
+            hero = {
+                "name": f"hero-{i:08}",
+                "secret_name": "S",
+                "age": rng.randint(1, 90),
+                "team_id": rng.choice([None, rng.randint(1, teams)]),
+                "city_id": rng.randint(1, cities),
+            }
+            file.write(json.dumps(hero) + "\n")
+
+
+async def post_file(path: Path) -> dict:
+    # Drives the ASGI app directly: the test client reads the whole request body into
+    # memory before calling the app, which would hide what the endpoint itself holds
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/heroes/import",
+        "raw_path": b"/heroes/import",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/x-ndjson")],
+        "client": ("127.0.0.1", 0),
+        "server": ("127.0.0.1", 80),
+    }
+    sent = []
+
+    with path.open("rb") as file:
+
+        async def receive():
+            chunk = file.read(CHUNK_BYTES)
+            return {"type": "http.request", "body": chunk, "more_body": bool(chunk)}
+
+        async def send(message):
+            if message["type"] == "http.response.body":
+                sent.append(message.get("body", b""))
+
+        await app(scope, receive, send)
+    return json.loads(b"".join(sent))
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--teams", type=int, default=100)
+    parser.add_argument("--cities", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    # RSS includes SQLite's page cache and mmap of the growing file; tracing shows
+    # the Python heap alone, at the cost of a much slower run
+    parser.add_argument("--trace-memory", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = build_database(Path(tmp) / "bench.db", args.teams, args.cities)
+        source = Path(tmp) / "heroes.ndjson"
+        write_file(source, args.rows, args.teams, args.cities, random.Random(args.seed))
+
+        def get_session_override():
+            with Session(engine) as session:
+                yield session
+
+        app.dependency_overrides[get_session] = get_session_override
+        rss_before = peak_rss_mb()
+
+        if args.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        result = asyncio.run(post_file(source))
+        elapsed = time.perf_counter() - start
+
+        with Session(engine) as session:
+            stored = session.exec(select(func.count()).select_from(Hero)).one()
+        print(f"rows={args.rows} file={source.stat().st_size / 2**20:.1f} MB")
+        print(f"imported={result['imported']} failed={result['failed']} stored={stored}")
+        print(f"elapsed: {elapsed:8.2f} s ({result['imported'] / elapsed:,.0f} rows/s)")
+        print(f"peak rss: {peak_rss_mb():8.1f} MB (was {rss_before:.1f} MB before the import)")
+        if args.trace_memory:
+            print(f"peak python heap: {tracemalloc.get_traced_memory()[1] / 2**20:8.1f} MB")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
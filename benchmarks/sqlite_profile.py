@@ -0,0 +1,96 @@
+"""Write/read throughput of a default SQLite engine vs the engines.py profile.
+
+Run from the directory that contains the repo:
+    python -m <repo>.benchmarks.sqlite_profile --writes 2000 --readers 8
+"""
+import argparse
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from sqlalchemy import insert, select
+from sqlmodel import Session, SQLModel, create_engine
+
+from .. import main
+from ..engines import sqlite_engine
+from ..seed import seed_main
+
+
+def insert_hero(engine):
+    row = {"name": "bench", "secret_name": "bench", "age": 1, "team_id": 1, "city_id": 1}
+    with Session(engine) as session:
+        session.execute(insert(main.Hero.__table__), row)
+        session.commit()
+
+
+def single_row_commits(engine, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        insert_hero(engine)
+    return count / (time.perf_counter() - start)
+
+
+def reads_during_writes(engine, readers: int, seconds: float, max_id: int) -> tuple[float, float]:
+    # readers run point selects while one writer keeps committing
+    stop = time.perf_counter() + seconds
+    counts = {"reads": 0, "writes": 0}
+    lock = threading.Lock()
+
+    def read():
+        rng = random.Random()
+        done = 0
+        while time.perf_counter() < stop:
+            with Session(engine) as session:
+                session.execute(select(main.Hero.__table__).where(main.Hero.id == rng.randint(1, max_id))).all()
+            done += 1
+        with lock:
+            counts["reads"] += done
+
+    def write():
+        while time.perf_counter() < stop:
+            insert_hero(engine)
+            counts["writes"] += 1
+
+    threads = [threading.Thread(target=read) for _ in range(readers)] + [threading.Thread(target=write)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts["reads"] / seconds, counts["writes"] / seconds
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--heroes", type=int, default=50_000)
+    parser.add_argument("--writes", type=int, default=2_000)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    profiles = {
+        "default": lambda url: create_engine(
+            url, connect_args={"check_same_thread": False}, pool_size=args.readers + 1
+        ),
+        "engines.py": lambda url: sqlite_engine(url, pool_size=args.readers + 1),
+    }
+    for name, make_engine in profiles.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = make_engine(f"sqlite:///{Path(tmp) / 'bench.db'}")
+            SQLModel.metadata.create_all(engine)
+            with Session(engine) as session:
+                seed_main(session, main, heroes=args.heroes, rng=random.Random(0))
+                session.commit()
+
+            commits = single_row_commits(engine, args.writes)
+            reads, writes = reads_during_writes(engine, args.readers, args.seconds, args.heroes)
+            print(
+                f"{name:>10}: {commits:8.1f} commits/s alone, "
+                f"{reads:9.1f} reads/s + {writes:7.1f} commits/s with {args.readers} readers"
+            )
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,188 @@
+"""Echo round trip, disconnect fan-out and event-loop lag of the chat with N sockets.
+
+Every client is an in-process ASGI websocket on the same event loop as the app, so
+nothing leaves the machine. Clients send the embedded page's "Track time" heartbeat
+every --heartbeat seconds of app time, compressed by --speedup, with their first
+beat spread over one interval. Afterwards a few clients disconnect one at a time
+and the harness times how long the "left the chat" broadcast takes to reach every
+remaining socket. Loop lag comes from the app's LoopLagMonitor.
+
+Run from the directory that contains the repo:
+    python -m <repo>.benchmarks.websocket_load --clients 10000 --rounds 5
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import tempfile
+import time
+from collections import deque
+from pathlib import Path
+
+from sqlmodel import Session, SQLModel, func, select
+
+from .. import websocket
+from ..engines import sqlite_engine
+from ..loop_monitor import LoopLagMonitor
+from ..asgi_websocket import WebSocketClient
+
+HEARTBEAT = "Track time"
+
+
+def percentiles(values: list[float]) -> dict:
+    # ms
+    if not values:
+        return {"count": 0}
+    cuts = statistics.quantiles(values, n=100, method="inclusive") if len(values) > 1 else values * 99
+    return {
+        "count": len(values),
+        "p50_ms": round(cuts[49] * 1000, 3),
+        "p95_ms": round(cuts[94] * 1000, 3),
+        "p99_ms": round(cuts[98] * 1000, 3),
+        "max_ms": round(max(values) * 1000, 3),
+    }
+
+
+class FanOut:
+    # one broadcast: done once every expected socket has received it
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.received = 0
+        self.last = 0.0
+        self.done = asyncio.Event()
+        if not expected:
+            self.done.set()
+
+    def arrived(self, at: float):
+        self.received += 1
+        self.last = at
+        if self.received == self.expected:
+            self.done.set()
+
+
+class Harness:
+    def __init__(self):
+        self.round_trips: list[float] = []
+        self.broadcasts: dict[str, FanOut] = {}
+        self.unexpected = 0
+
+    async def read(self, socket: WebSocketClient, sent: deque[float]):
+        try:
+            while True:
+                text = await socket.receive_text()
+                now = time.perf_counter()
+                if text == f"You wrote: {HEARTBEAT}":
+                    self.round_trips.append(now - sent.popleft())
+                elif text in self.broadcasts:
+                    self.broadcasts[text].arrived(now)
+                else:
+                    self.unexpected += 1
+        except ConnectionError:
+            pass
+
+    async def beat(self, socket: WebSocketClient, sent: deque[float], rounds: int, interval: float, delay: float):
+        await asyncio.sleep(delay)
+        for _ in range(rounds):
+            sent.append(time.perf_counter())
+            await socket.send_text(HEARTBEAT)
+            await asyncio.sleep(interval)
+
+    async def fan_out(self, client_id: int, socket: WebSocketClient, reader: asyncio.Task, receivers: int) -> float:
+        fan_out = self.broadcasts[f"Client #{client_id} left the chat"] = FanOut(receivers)
+        start = time.perf_counter()
+        await socket.close()
+        reader.cancel()
+        await fan_out.done.wait()
+        return (fan_out.last or time.perf_counter()) - start
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    interval = args.heartbeat / args.speedup
+    harness = Harness()
+    websocket.message_buffer.start()
+    # the app's own monitor, sampling faster and keeping every lag for the percentiles
+    monitor = LoopLagMonitor(args.lag_interval, args.lag_threshold / 1000, history=None)
+    monitor.start()
+
+    start = time.perf_counter()
+    sockets = {client_id: WebSocketClient(websocket.app, f"/ws/{client_id}") for client_id in range(1, args.clients + 1)}
+    for socket in sockets.values():
+        await socket.connect()
+    connected = time.perf_counter() - start
+
+    sent = {client_id: deque() for client_id in sockets}
+    readers = {
+        client_id: asyncio.create_task(harness.read(socket, sent[client_id])) for client_id, socket in sockets.items()
+    }
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            harness.beat(socket, sent[client_id], args.rounds, interval, rng.uniform(0, interval))
+            for client_id, socket in sockets.items()
+        )
+    )
+    # the last beats' echoes
+    while len(harness.round_trips) < args.clients * args.rounds:
+        await asyncio.sleep(0.01)
+    chatting = time.perf_counter() - start
+
+    fan_outs = []
+    leaving = rng.sample(sorted(sockets), min(args.fan_out_samples, args.clients))
+    for client_id in leaving:
+        socket = sockets.pop(client_id)
+        fan_outs.append(await harness.fan_out(client_id, socket, readers.pop(client_id), len(sockets)))
+
+    await monitor.stop()
+    # the rest are dropped with the loop: closing them one by one would broadcast
+    # every goodbye to all the others, quadratic in --clients
+    await websocket.message_buffer.stop()
+    websocket.db.shutdown()
+    with Session(websocket.engine) as session:
+        persisted = session.exec(select(func.count()).select_from(websocket.WebsocketMessage)).one()
+
+    return {
+        "clients": args.clients,
+        "rounds": args.rounds,
+        "heartbeat_interval_s": interval,
+        "connect_s": round(connected, 3),
+        "chat_s": round(chatting, 3),
+        "messages_per_s": round(args.clients * args.rounds / chatting, 1),
+        "echo_round_trip": percentiles(harness.round_trips),
+        "fan_out": {"receivers": args.clients - 1, **percentiles(fan_outs)},
+        "loop_lag": {**percentiles(list(monitor.lags)), "blocked_intervals": monitor.blocked},
+        "unexpected_messages": harness.unexpected,
+        "write_behind": {
+            "flushes": websocket.message_buffer.flushes,
+            "flushed_rows": websocket.message_buffer.flushed_rows,
+            "failed_rows": websocket.message_buffer.failed_rows,
+            "persisted_rows": persisted,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=1_000)
+    parser.add_argument("--rounds", type=int, default=5, help="heartbeats per client")
+    parser.add_argument("--heartbeat", type=float, default=60, help="app-time seconds between heartbeats")
+    parser.add_argument("--speedup", type=float, default=60, help="app seconds per real second")
+    parser.add_argument("--fan-out-samples", type=int, default=5, help="clients that disconnect one by one")
+    parser.add_argument("--lag-interval", type=float, default=0.01)
+    parser.add_argument("--lag-threshold", type=float, default=100, help="ms of lag counted as blocked")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = sqlite_engine(f"sqlite:///{Path(tmp) / 'bench.db'}", pool_size=10)
+        SQLModel.metadata.create_all(engine)
+        websocket.engine = engine
+        websocket.message_buffer.engine = engine
+        report = asyncio.run(run(args))
+        engine.dispose()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
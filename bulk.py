@@ -0,0 +1,192 @@
+from collections import defaultdict
+from collections.abc import AsyncIterator, Callable
+from itertools import islice
+from typing import Any
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import Table, bindparam, delete, insert, select, update
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import Session, SQLModel
+
+CHUNK_SIZE = 500
+MAX_ITEMS = 10_000
+IMPORT_BATCH_SIZE = 5000
+MAX_LINE_BYTES = 64 * 1024
+MAX_IMPORT_ERRORS = 100
+
+# (position in the request body, column values)
+Row = tuple[int, dict[str, Any]]
+
+
+class BulkError(SQLModel):
+    index: int
+    detail: Any
+
+
+class BulkResult(SQLModel):
+    # one entry per submitted item: the row id, or None when the item failed
+    ids: list[int | None]
+    errors: list[BulkError] = []
+
+
+class ImportResult(SQLModel):
+    received: int = 0
+    imported: int = 0
+    failed: int = 0
+    # the first MAX_IMPORT_ERRORS failures; index is the line's position in the body
+    errors: list[BulkError] = []
+
+    def add(self, received: int, imported: int, errors: list[BulkError]):
+        self.received += received
+        self.imported += imported
+        self.failed += len(errors)
+        room = MAX_IMPORT_ERRORS - len(self.errors)
+        if room > 0:
+            self.errors.extend(sorted(errors, key=lambda error: error.index)[:room])
+
+
+def validate_items(
+    items: list[Any], schema: type[SQLModel], *, exclude_unset: bool = False
+) -> tuple[list[Row], list[BulkError]]:
+    # inserts need every column in every row; updates only the fields that were sent
+    rows, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            model = schema.model_validate(item)
+        except ValidationError as exc:
+            errors.append(BulkError(index=index, detail=exc.errors(include_url=False, include_context=False)))
+        else:
+            rows.append((index, model.model_dump(exclude_unset=exclude_unset)))
+    return rows, errors
+
+
+def validate_lines(lines: list[tuple[int, bytes]], schema: type[SQLModel]) -> tuple[list[Row], list[BulkError]]:
+    rows, errors = [], []
+    for index, line in lines:
+        try:
+            model = schema.model_validate_json(line)
+        except ValidationError as exc:
+            errors.append(BulkError(index=index, detail=exc.errors(include_url=False, include_context=False)))
+        else:
+            rows.append((index, model.model_dump()))
+    return rows, errors
+
+
+async def ndjson_batches(
+    stream: AsyncIterator[bytes], size: int = IMPORT_BATCH_SIZE
+) -> AsyncIterator[list[tuple[int, bytes]]]:
+    # Holds at most one batch of lines plus a partial line; the next body chunk is
+    # only read once the caller is done with the current batch. Blank lines are
+    # skipped but keep their position.
+    batch: list[tuple[int, bytes]] = []
+    pending = b""
+    index = 0
+    async for data in stream:
+        *lines, pending = (pending + data).split(b"\n")
+        if len(pending) > MAX_LINE_BYTES:
+            raise HTTPException(status_code=413, detail=f"Line {index + len(lines)} is too long")
+        for line in lines:
+            if line.strip():
+                batch.append((index, line))
+            index += 1
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if pending.strip():
+        batch.append((index, pending))
+    if batch:
+        yield batch
+
+
+def chunked(rows: list, size: int = CHUNK_SIZE):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def write_chunks(
+    session: Session, rows: list[Row], write: Callable[[Session, list[Row]], dict[int, int]]
+) -> tuple[dict[int, int], list[BulkError]]:
+    # Each chunk is one transaction. A chunk the database rejects is replayed row by
+    # row, so only the offending items are reported and the rest are still written.
+    written: dict[int, int] = {}
+    errors: list[BulkError] = []
+    for chunk in chunked(rows):
+        try:
+            written.update(write(session, chunk))
+            session.commit()
+            continue
+        except DBAPIError:
+            session.rollback()
+        for row in chunk:
+            try:
+                written.update(write(session, [row]))
+                session.commit()
+            except DBAPIError as exc:
+                session.rollback()
+                errors.append(BulkError(index=row[0], detail=str(exc.orig)))
+    return written, errors
+
+
+def insert_rows(table: Table, *, returning: bool = True):
+    # Ordered RETURNING makes SQLite run one statement per row; without it the chunk
+    # is a single executemany, for callers that do not need the new ids
+    def write(session: Session, rows: list[Row]) -> dict[int, int | None]:
+        if not returning:
+            session.execute(insert(table), [values for _, values in rows])
+            return {index: None for index, _ in rows}
+        statement = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+        ids = session.execute(statement, [values for _, values in rows]).scalars().all()
+        return {index: row_id for (index, _), row_id in zip(rows, ids)}
+
+    return write
+
+
+def update_rows(table: Table):
+    # rows carry their "id"; items setting the same columns share one executemany
+    def write(session: Session, rows: list[Row]) -> dict[int, int]:
+        groups: defaultdict[tuple[str, ...], list[Row]] = defaultdict(list)
+        for index, values in rows:
+            groups[tuple(sorted(key for key in values if key != "id"))].append((index, values))
+        for columns, group in groups.items():
+            if not columns:
+                continue
+            statement = (
+                update(table)
+                .where(table.c.id == bindparam("b_id"))
+                .values({column: bindparam(f"b_{column}") for column in columns})
+            )
+            params = [{f"b_{key}": value for key, value in values.items()} for _, values in group]
+            session.execute(statement, params)
+        return {index: values["id"] for index, values in rows}
+
+    return write
+
+
+def delete_rows(table: Table, before: Callable[[Session, list[int]], None] | None = None):
+    def write(session: Session, rows: list[Row]) -> dict[int, int]:
+        ids = [values["id"] for _, values in rows]
+        if before:
+            before(session, ids)
+        session.execute(delete(table).where(table.c.id.in_(ids)))
+        return {index: values["id"] for index, values in rows}
+
+    return write
+
+
+def split_missing(session: Session, table: Table, rows: list[Row]) -> tuple[list[Row], list[BulkError]]:
+    found: set[int] = set()
+    for chunk in chunked(rows):
+        ids = [values["id"] for _, values in chunk]
+        found.update(session.execute(select(table.c.id).where(table.c.id.in_(ids))).scalars())
+    existing = [row for row in rows if row[1]["id"] in found]
+    errors = [BulkError(index=index, detail="Not found") for index, values in rows if values["id"] not in found]
+    return existing, errors
+
+
+def bulk_result(count: int, written: dict[int, int], errors: list[BulkError]) -> BulkResult:
+    return BulkResult(
+        ids=[written.get(index) for index in range(count)],
+        errors=sorted(errors, key=lambda error: error.index),
+    )
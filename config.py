@@ -0,0 +1,64 @@
+import os
+
+
+def _parse_mapping(value: str) -> dict[str, str]:
+    pairs = (item.split("=", 1) for item in value.split(",") if "=" in item)
+    return {key.strip(): val.strip() for key, val in pairs}
+
+
+def _loading_strategy(value: str) -> dict[str, str]:
+    # checked at import: a typo would otherwise fail every request that loads the path
+    strategy = {"team": "joined", "city": "joined", "city.region": "joined", "heroes": "selectin"}
+    for path, loader in _parse_mapping(value).items():
+        if path not in strategy or loader not in {"joined", "selectin"}:
+            paths = ", ".join(strategy)
+            raise ValueError(f"HEROES_LOADING: {path}={loader}, expected joined or selectin for {paths}")
+        strategy[path] = loader
+    return strategy
+
+
+# How each relationship of the nested hero/team responses is eager loaded,
+# "selectin" or "joined". Override with e.g. HEROES_LOADING="team=selectin,heroes=joined"
+LOADING_STRATEGY = _loading_strategy(os.environ.get("HEROES_LOADING", ""))
+
+# Total used by the pagination.py page envelope: "exact" runs COUNT(*) (cached until
+# the hero table changes in any worker, or for HEROES_COUNT_TTL seconds), "estimated"
+# reads MAX(id)
+COUNT_MODE = os.environ.get("HEROES_COUNT_MODE", "exact")
+COUNT_TTL = float(os.environ["HEROES_COUNT_TTL"]) if "HEROES_COUNT_TTL" in os.environ else None
+
+# websocket.py broadcast queues: messages buffered per client, and what to do with a
+# client whose queue is full ("drop", "coalesce" or "disconnect")
+BROADCAST_QUEUE_SIZE = int(os.environ.get("BROADCAST_QUEUE_SIZE", "100"))
+SLOW_CONSUMER_POLICY = os.environ.get("SLOW_CONSUMER_POLICY", "drop")
+
+# "async" serves the heroes/teams API from main_async.py (aiosqlite, async handlers);
+# the bulk, import, export and search routes stay on main.py's sync handlers
+DB_MODE = os.environ.get("HEROES_DB_MODE", "sync")
+
+# Log every SQL statement; off by default because the logging itself costs throughput
+SQL_ECHO = os.environ.get("SQL_ECHO", "") == "1"
+
+# Cache of serialized hero/team detail responses: "local" (per process) or "sqlite"
+# (a file shared by all workers on the host, at RESPONSE_CACHE_PATH)
+RESPONSE_CACHE_BACKEND = os.environ.get("RESPONSE_CACHE_BACKEND", "local")
+RESPONSE_CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH", "response_cache.db")
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "10000"))
+RESPONSE_CACHE_TTL = float(os.environ["RESPONSE_CACHE_TTL"]) if "RESPONSE_CACHE_TTL" in os.environ else None
+
+# List endpoints project rows straight to dicts and encode them with orjson (when it
+# is installed), skipping the response_model validation pass. Same JSON and schema.
+FAST_JSON = os.environ.get("HEROES_FAST_JSON", "") == "1"
+
+# Per-request SQL instrumentation (instrumentation.py). Statements slower than
+# HEROES_SLOW_QUERY_MS are logged, so is a request that runs the same statement more
+# than HEROES_N_PLUS_ONE_THRESHOLD times (a likely N+1). The Server-Timing header
+# lists the HEROES_SERVER_TIMING_SLOWEST slowest statements; 0 leaves SQL out of it.
+SLOW_QUERY_MS = float(os.environ.get("HEROES_SLOW_QUERY_MS", "100"))
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("HEROES_N_PLUS_ONE_THRESHOLD", "10"))
+SERVER_TIMING_SLOWEST = int(os.environ.get("HEROES_SERVER_TIMING_SLOWEST", "3"))
+
+# websocket.py runs all of its SQL on a pool of this many threads of its own, and
+# logs every time its event loop is blocked for longer than HEROES_LOOP_LAG_MS
+WEBSOCKET_DB_THREADS = int(os.environ.get("WEBSOCKET_DB_THREADS", "4"))
+LOOP_LAG_THRESHOLD_MS = float(os.environ.get("HEROES_LOOP_LAG_MS", "100"))
@@ -0,0 +1,33 @@
+import threading
+import time
+from collections.abc import Callable, Hashable
+
+
+class CountCache:
+    # A count is stored with the version it was computed at (e.g. a table_version
+    # counter read just before the COUNT), and a lookup with another version computes
+    # it again: writes from any process show up on the next read.
+    def __init__(self, ttl: float | None = None):
+        # ttl=None keeps a count until the version moves or invalidate() is called
+        self.ttl = ttl
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._entries: dict[Hashable, tuple[int, float, Hashable]] = {}
+
+    def get(self, key: Hashable, compute: Callable[[], int], version: Hashable = None) -> int:
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry[2] == version and (self.ttl is None or now - entry[1] < self.ttl):
+            return entry[0]
+        since = self._generation
+        value = compute()
+        with self._lock:
+            # an invalidate() while counting: the value may predate that write
+            if self._generation == since:
+                self._entries[key] = (value, now, version)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
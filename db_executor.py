@@ -0,0 +1,44 @@
+import asyncio
+import contextvars
+import functools
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypeVar
+
+from sqlmodel import Session
+
+T = TypeVar("T")
+
+
+class DatabaseExecutor:
+    # Sync Session work for async handlers, on a thread pool of its own. The event loop
+    # never waits on SQLite, a burst of socket traffic cannot take threads from the
+    # HTTP handlers in Starlette's shared pool, and max_workers bounds the connections
+    # it holds. The pool is created on first use, so shutdown() at the end of a
+    # lifespan leaves the executor usable by the next one.
+    def __init__(self, max_workers: int, name: str):
+        self.max_workers = max_workers
+        self.name = name
+        self._pool: ThreadPoolExecutor | None = None
+
+    async def run(self, fn: Callable[..., T], *args) -> T:
+        # like asyncio.to_thread: the caller's context (e.g. request metrics) goes along
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix=self.name)
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(self._pool, call)
+
+    async def run_session(self, engine, fn: Callable[..., T], *args) -> T:
+        # fn(session, *args) in a session of its own
+        return await self.run(_with_session, engine, fn, *args)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+
+def _with_session(engine, fn, *args):
+    with Session(engine) as session:
+        return fn(session, *args)
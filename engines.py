@@ -0,0 +1,51 @@
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import create_engine
+
+from . import config
+
+# Applied to every new connection. WAL lets readers run alongside the single writer,
+# synchronous=NORMAL only fsyncs at checkpoints (safe with WAL), and the memory map
+# and page cache keep hot pages out of read() calls. busy_timeout makes writers wait
+# for the lock instead of failing with "database is locked".
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,
+    "busy_timeout": 5000,
+    "temp_store": "MEMORY",
+}
+
+
+def apply_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def sqlite_engine(url: str, *, pool_size: int, echo: bool | None = None):
+    # Size the pool to the threads that can hold a session at once (Starlette's
+    # threadpool runs 40 sync handlers): with fewer connections, handlers waiting
+    # for one can starve the session cleanup that would return it.
+    engine = create_engine(
+        url,
+        echo=config.SQL_ECHO if echo is None else echo,
+        connect_args={"check_same_thread": False},
+        pool_size=pool_size,
+        max_overflow=0,
+    )
+    event.listen(engine, "connect", apply_pragmas)
+    return engine
+
+
+def async_sqlite_engine(url: str, *, pool_size: int, echo: bool | None = None):
+    engine = create_async_engine(
+        url,
+        echo=config.SQL_ECHO if echo is None else echo,
+        pool_size=pool_size,
+        max_overflow=0,
+    )
+    event.listen(engine.sync_engine, "connect", apply_pragmas)
+    return engine
@@ -0,0 +1,76 @@
+import hashlib
+
+from fastapi import Depends, HTTPException, Request, Response
+from sqlalchemy import DDL, Column, Integer, MetaData, String, Table, event, select, text
+
+
+class TableVersions:
+    # Per-table write counters kept in the database by triggers on every insert,
+    # update and delete of the watched tables. They move in the writing transaction,
+    # whichever worker (or other client of the file) made it, so every process tags
+    # responses from the same versions and none answers 304 for data that changed
+    # elsewhere. Registered on the tables' create events, like FullTextIndex.
+    def __init__(self, metadata: MetaData, session_dependency, *sources: Table):
+        self.session_dependency = session_dependency
+        self.sources = sources
+        self.table = Table(
+            "table_version",
+            metadata,
+            Column("name", String, primary_key=True),
+            Column("version", Integer, nullable=False),
+        )
+        for source in sources:
+            for statement in self.statements(source):
+                event.listen(source, "after_create", DDL(statement))
+
+    def statements(self, source: Table) -> list[str]:
+        bump = (
+            f"INSERT INTO {self.table.name}(name, version) VALUES ('{source.name}', 1) "
+            "ON CONFLICT(name) DO UPDATE SET version = version + 1"
+        )
+        return [
+            f"CREATE TRIGGER IF NOT EXISTS {source.name}_version_{suffix} AFTER {operation} ON {source.name} "
+            f"BEGIN {bump}; END"
+            for suffix, operation in [("ai", "INSERT"), ("au", "UPDATE"), ("ad", "DELETE")]
+        ]
+
+    def create(self, connection):
+        # for databases whose tables already exist
+        self.table.create(connection, checkfirst=True)
+        for source in self.sources:
+            for statement in self.statements(source):
+                connection.execute(text(statement))
+
+    def versions_statement(self, tables: tuple[str, ...]):
+        return select(self.table.c.name, self.table.c.version).where(self.table.c.name.in_(tables))
+
+    def versions(self, session, tables: tuple[str, ...]) -> dict[str, int]:
+        return dict(session.execute(self.versions_statement(tables)).all())
+
+    def etag(self, request: Request, tables: tuple[str, ...], current: dict[str, int]) -> str:
+        versions = ",".join(f"{table}={current.get(table, 0)}" for table in tables)
+        raw = f"{request.url.path}?{request.url.query}|{versions}"
+        return f'"{hashlib.sha1(raw.encode()).hexdigest()}"'
+
+    def check(self, request: Request, response: Response, etag: str):
+        if_none_match = request.headers.get("if-none-match", "")
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in candidates or "*" in candidates:
+            raise HTTPException(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+
+    def conditional_get(self, *tables: str):
+        # Answers If-None-Match from the version counters alone, one primary key
+        # lookup, before the endpoint (and its query) runs
+        def check_etag(request: Request, response: Response, session=Depends(self.session_dependency)):
+            self.check(request, response, self.etag(request, tables, self.versions(session, tables)))
+
+        return Depends(check_etag)
+
+    def async_conditional_get(self, session_dependency, *tables: str):
+        # the same check on an AsyncSession, for async handlers: no threadpool hop
+        async def check_etag(request: Request, response: Response, session=Depends(session_dependency)):
+            current = dict((await session.exec(self.versions_statement(tables))).all())
+            self.check(request, response, self.etag(request, tables, current))
+
+        return Depends(check_etag)
@@ -0,0 +1,21 @@
+import json
+
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:  # optional; the standard library encoder is used without it
+    orjson = None
+
+
+def encode(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def fast_json(content, response: Response | None = None) -> Response:
+    # Encodes plain dicts and lists as they are: no response_model validation or
+    # serialization pass, so callers must already produce the documented shape
+    headers = dict(response.headers) if response is not None else None
+    return Response(content=encode(content), media_type="application/json", headers=headers)
@@ -2,15 +2,16 @@ from typing import AsyncGenerator
 
 from fastapi import FastAPI
 from fastcrud import FastCRUD, crud_router
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import sessionmaker
 
+from .engines import async_sqlite_engine
 from .models import Base, Item
 from .schemas import ItemCreateSchema, ItemUpdateSchema
 
 # Database setup (Async SQLAlchemy)
 DATABASE_URL = "sqlite+aiosqlite:///./test.db"
-engine = create_async_engine(DATABASE_URL, echo=True)
+engine = async_sqlite_engine(DATABASE_URL, pool_size=20)
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
@@ -0,0 +1,50 @@
+import sys
+
+from sqlalchemy import and_
+
+
+def prefix_upper_bound(prefix: str) -> str | None:
+    # The first string after every string that starts with prefix, in code point
+    # order (BINARY on UTF-8). A trailing U+10FFFF cannot be incremented, so it is
+    # dropped and the character before it is; a prefix of nothing else has no bound.
+    # Surrogates cannot be encoded, so U+D7FF is followed by U+E000.
+    stripped = prefix.rstrip(chr(sys.maxunicode))
+    if not stripped:
+        return None
+    following = ord(stripped[-1]) + 1
+    if following == 0xD800:
+        following = 0xE000
+    return stripped[:-1] + chr(following)
+
+
+def starts_with(column, prefix: str):
+    # A range rather than LIKE 'prefix%': SQLite only serves LIKE from an index when
+    # case_sensitive_like is on, while the range matches the same rows under the
+    # default BINARY collation and is a plain index search
+    upper = prefix_upper_bound(prefix)
+    if upper is None:
+        return column >= prefix
+    return and_(column >= prefix, column < upper)
+
+
+def filter_heroes(
+    statement,
+    model,
+    *,
+    name_prefix: str | None = None,
+    min_age: int | None = None,
+    max_age: int | None = None,
+    team_id: int | None = None,
+    city_id: int | None = None,
+):
+    if name_prefix:
+        statement = statement.where(starts_with(model.name, name_prefix))
+    if min_age is not None:
+        statement = statement.where(model.age >= min_age)
+    if max_age is not None:
+        statement = statement.where(model.age <= max_age)
+    if team_id is not None:
+        statement = statement.where(model.team_id == team_id)
+    if city_id is not None:
+        statement = statement.where(model.city_id == city_id)
+    return statement
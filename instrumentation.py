@@ -0,0 +1,233 @@
+import heapq
+import logging
+import re
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from functools import lru_cache
+
+from fastapi import FastAPI, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# Seconds; the Prometheus client's default buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+# expanding IN lists render one placeholder per value: count them as one shape
+_PLACEHOLDERS = re.compile(r"\(\?(?:\s*,\s*\?)+\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def statement_shape(statement: str) -> str:
+    return _PLACEHOLDERS.sub("(?)", _WHITESPACE.sub(" ", statement).strip())
+
+
+class RequestStats:
+    # What one request did on the database. Sync handlers and their dependencies run
+    # one after another in the threadpool, so nothing here needs a lock.
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.slow_queries = 0
+        self.shapes: Counter[str] = Counter()
+        self._slowest: list[tuple[float, int, str]] = []
+
+    def record(self, statement: str, elapsed: float, executemany: bool = False):
+        self.queries += 1
+        self.db_time += elapsed
+        # a batched executemany (bulk chunks, write-behind flushes) is not an N+1
+        if not executemany:
+            self.shapes[statement_shape(statement)] += 1
+        if config.SERVER_TIMING_SLOWEST > 0:
+            entry = (elapsed, self.queries, statement)
+            if len(self._slowest) < config.SERVER_TIMING_SLOWEST:
+                heapq.heappush(self._slowest, entry)
+            else:
+                heapq.heappushpop(self._slowest, entry)
+
+    def slowest(self) -> list[tuple[float, str]]:
+        return [(elapsed, statement) for elapsed, _, statement in sorted(self._slowest, reverse=True)]
+
+    def repeated(self) -> dict[str, int]:
+        return {shape: count for shape, count in self.shapes.items() if count > config.N_PLUS_ONE_THRESHOLD}
+
+    def server_timing(self, elapsed: float) -> str:
+        metrics = [
+            f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries"',
+            f"app;dur={elapsed * 1000:.2f}",
+        ]
+        for position, (duration, statement) in enumerate(self.slowest(), 1):
+            metrics.append(f'db-{position};dur={duration * 1000:.2f};desc="{_describe(statement)}"')
+        return ", ".join(metrics)
+
+
+def _describe(statement: str, size: int = 80) -> str:
+    # a quoted-string that fits a latin-1 header
+    text = statement_shape(statement)
+    if len(text) > size:
+        text = text[: size - 3] + "..."
+    text = text.replace("\\", "\\\\").replace('"', '\\"')
+    return text.encode("latin-1", "replace").decode("latin-1")
+
+
+_current: ContextVar[RequestStats | None] = ContextVar("db_request_stats", default=None)
+
+
+def current_stats() -> RequestStats | None:
+    return _current.get()
+
+
+# Listening on the Engine class covers every engine in the process, the async
+# engines' sync_engine and the test engines included. Statements outside a request
+# (setup, write-behind flushes) still go through the slow query log.
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = _current.get()
+    if stats is not None:
+        stats.record(statement, elapsed, executemany)
+    if elapsed * 1000 >= config.SLOW_QUERY_MS:
+        if stats is not None:
+            stats.slow_queries += 1
+        logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, statement_shape(statement))
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    # a failed statement never reaches after_cursor_execute
+    starts = context.connection.info.get("query_start") if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name: str, labels: str) -> list[str]:
+        lines, total = [], 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            total += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class Metrics:
+    # Per-route series, labelled with the route template rather than the URL so ids
+    # do not multiply them. Only the event loop updates these.
+    def __init__(self):
+        self.latency: dict[tuple, Histogram] = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.db_time: dict[tuple, Histogram] = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.queries: dict[tuple, Histogram] = defaultdict(lambda: Histogram(QUERY_BUCKETS))
+        self.responses: Counter[tuple] = Counter()
+        self.slow_queries: Counter[tuple] = Counter()
+        self.repeated: Counter[tuple] = Counter()
+
+    def observe(self, method: str, route: str, status: int, elapsed: float, stats: RequestStats):
+        key = (method, route)
+        self.latency[key].observe(elapsed)
+        self.db_time[key].observe(stats.db_time)
+        self.queries[key].observe(stats.queries)
+        self.responses[(method, route, status)] += 1
+        if stats.slow_queries:
+            self.slow_queries[key] += stats.slow_queries
+        for shape, count in stats.repeated().items():
+            self.repeated[key] += 1
+            logger.warning("Possible N+1: %s %s ran %d times: %s", method, route, count, shape)
+
+    def render(self) -> str:
+        lines = []
+        for name, help_text, series in [
+            ("http_request_duration_seconds", "Request latency by route", self.latency),
+            ("db_request_duration_seconds", "Time spent in SQL per request", self.db_time),
+            ("db_queries_per_request", "SQL statements per request", self.queries),
+        ]:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for (method, route), histogram in sorted(series.items()):
+                lines += histogram.lines(name, _labels(method=method, route=route))
+        for name, help_text, counter in [
+            ("http_responses_total", "Responses by route and status", self.responses),
+            ("db_slow_queries_total", "Statements over the slow query threshold", self.slow_queries),
+            ("db_repeated_statements_total", "Requests that repeated a statement (possible N+1)", self.repeated),
+        ]:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for key, value in sorted(counter.items()):
+                labels = dict(zip(("method", "route", "status"), key))
+                lines.append(f"{name}{{{_labels(**labels)}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(**labels) -> str:
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return ",".join(f'{key}="{escape(value)}"' for key, value in labels.items())
+
+
+class DBMetricsMiddleware:
+    # Plain ASGI rather than BaseHTTPMiddleware: the handler has to run in this
+    # context to see the RequestStats, and streamed bodies pass through untouched.
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                # a streamed response only reports the queries made before its first chunk
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", stats.server_timing(time.perf_counter() - start))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            # the router records the matched route in the scope
+            route = getattr(scope.get("route"), "path", None) or "<unmatched>"
+            self.metrics.observe(scope["method"], route, status, time.perf_counter() - start, stats)
+
+
+def instrument(app: FastAPI) -> Metrics:
+    metrics = Metrics()
+    app.add_middleware(DBMetricsMiddleware, metrics=metrics)
+
+    async def read_metrics():
+        # on the event loop, like every update
+        return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    app.add_api_route("/metrics", read_metrics, methods=["GET"], include_in_schema=False)
+    return metrics
@@ -0,0 +1,55 @@
+import base64
+import json
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(values: list) -> str:
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(padded))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != 3:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # a hand-made cursor must not reach the WHERE clause with a list, an object or a bool
+    order_by, value, last_id = values
+    valid_value = value is None or (isinstance(value, str | int | float) and not isinstance(value, bool))
+    if not isinstance(order_by, str) or type(last_id) is not int or not valid_value:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def after(column, id_column, value, last_id):
+    # Rows that come after (value, last_id) in ORDER BY column, id. SQLite sorts
+    # NULLs first, so a NULL value still has the non-NULL rows ahead of it.
+    if column is None:
+        return id_column > last_id
+    if value is None:
+        return or_(and_(column.is_(None), id_column > last_id), column.is_not(None))
+    return or_(column > value, and_(column == value, id_column > last_id))
+
+
+def paginate(statement, model, *, order_by: str, cursor: str | None, offset: int, limit: int):
+    column = None if order_by == "id" else getattr(model, order_by)
+    if cursor is not None:
+        cursor_order, value, last_id = decode_cursor(cursor)
+        if cursor_order != order_by:
+            raise HTTPException(status_code=400, detail="Cursor does not match order_by")
+        statement = statement.where(after(column, model.id, value, last_id))
+    order = [model.id] if column is None else [column, model.id]
+    return statement.order_by(*order).offset(offset).limit(limit)
+
+
+def next_cursor(rows, *, order_by: str, limit: int) -> str | None:
+    if not rows or len(rows) < limit:
+        return None
+    last = rows[-1]
+    value = None if order_by == "id" else getattr(last, order_by)
+    return encode_cursor([order_by, value, last.id])
@@ -0,0 +1,56 @@
+import asyncio
+import contextlib
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class LoopLagMonitor:
+    # Sleeps for `interval` and measures how late it wakes up: time the event loop
+    # spent in code that did not yield, e.g. a sync DB call inside an async handler.
+    # Anything later than `threshold` is logged and counted as a blocked interval.
+    # The last `history` lags are kept for reports (None keeps all of them).
+    def __init__(self, interval: float = 0.05, threshold: float = 0.1, history: int | None = 1000):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags: deque[float] = deque(maxlen=history)
+        self.samples = 0
+        self.blocked = 0
+        self.blocked_seconds = 0.0
+        self.max_lag = 0.0
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.observe(max(0.0, loop.time() - start - self.interval))
+
+    def observe(self, lag: float):
+        self.samples += 1
+        self.lags.append(lag)
+        self.max_lag = max(self.max_lag, lag)
+        if lag > self.threshold:
+            self.blocked += 1
+            self.blocked_seconds += lag
+            logger.warning("Event loop blocked for %.1f ms", lag * 1000)
+
+    def stats(self) -> dict:
+        return {
+            "loop_lag_samples": self.samples,
+            "loop_lag_max_ms": round(self.max_lag * 1000, 3),
+            "loop_blocked_intervals": self.blocked,
+            "loop_blocked_ms": round(self.blocked_seconds * 1000, 3),
+        }
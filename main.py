@@ -1,5 +1,47 @@
-from fastapi import Depends, FastAPI, HTTPException, Query
-from sqlmodel import Field, Relationship, Session, SQLModel, create_engine, select
+import csv
+import io
+import json
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import asynccontextmanager
+from typing import Any, Literal
+
+from fastapi import Body, Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import Index, update
+from sqlalchemy.orm import joinedload, load_only, selectinload
+from sqlmodel import Field, Relationship, Session, SQLModel, col, func, select
+
+from . import config
+from .bulk import (
+    MAX_ITEMS,
+    BulkError,
+    BulkResult,
+    Row,
+    ImportResult,
+    bulk_result,
+    chunked,
+    delete_rows,
+    insert_rows,
+    ndjson_batches,
+    split_missing,
+    update_rows,
+    validate_items,
+    validate_lines,
+    write_chunks,
+)
+from .engines import sqlite_engine
+from .etag import TableVersions
+from .fast_json import fast_json
+from .filters import filter_heroes
+from .instrumentation import instrument
+from .keyset import next_cursor, paginate
+from .response_cache import LocalBackend, ResponseCache, SQLiteBackend
+from .reference import ReferenceCache
+from .search import FullTextIndex
+from .seed import create_missing_indexes, initialize, insert_batched
+from .sparse import Relation, Selection, dump, load_columns, parse_selection
 
 
 class RegionBase(SQLModel):
@@ -69,6 +111,12 @@ class HeroBase(SQLModel):
 
 
 class Hero(HeroBase, table=True):
+    # filtered lists read a team's or city's heroes in id order straight off these
+    __table_args__ = (
+        Index("ix_hero_team_id_id", "team_id", "id"),
+        Index("ix_hero_city_id_id", "city_id", "id"),
+    )
+
     id: int | None = Field(default=None, primary_key=True)
 
     team: Team | None = Relationship(back_populates="heroes")
@@ -99,66 +147,65 @@ class TeamPublicWithHeroes(TeamPublic):
     heroes: list[HeroPublicWithTeam] = []
 
 
+class TeamPublicWithPreview(TeamPublic):
+    hero_count: int
+    heroes_preview: list[HeroPublicWithTeam] = []
+
+
+# what a team route returns: every hero, or with heroes_preview=N the preview shape
+TeamResponse = TeamPublicWithHeroes | TeamPublicWithPreview
+
+
+class HeroBulkUpdate(HeroUpdate):
+    id: int
+
+
+class TeamBulkUpdate(TeamUpdate):
+    id: int
+
+
+hero_search = FullTextIndex(Hero.__table__, ["name", "secret_name"], weights=[2.0, 1.0])
+
+
 sqlite_file_name = "database.db"
 sqlite_url = f"sqlite:///{sqlite_file_name}"
 
-connect_args = {"check_same_thread": False}
-engine = create_engine(sqlite_url, echo=True, connect_args=connect_args)
+engine = sqlite_engine(sqlite_url, pool_size=40)
 
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+# Bump when setup_database gains a step that existing databases need to run
+SCHEMA_VERSION = 4
 
 
-def create_teams():
-    generator = get_session()
-    session = next(generator)
+def create_teams(session: Session):
+    rows = [
+        {"name": "X-men", "headquarters": "House"},
+        {"name": "Sinister six", "headquarters": "roof"},
+    ]
+    insert_batched(session, Team, rows)
 
-    db_model = Team(name="X-men", headquarters="House")
-    db_model2 = Team(name="Sinister six", headquarters="roof")
-    session.add(db_model)
-    session.add(db_model2)
 
-    session.commit()
+def create_heroes(session: Session):
+    rows = [
+        {"name": "Spider", "secret_name": "Pak", "age": 23, "team_id": 1, "city_id": 1},
+        {"name": "Rust", "secret_name": "Tone", "age": 37, "team_id": 2, "city_id": 2},
+        {"name": "Aqua", "secret_name": "Mor", "age": 42, "team_id": 1, "city_id": 3},
+    ]
+    insert_batched(session, Hero, rows)
 
 
-def create_heroes():
-    session = next(get_session())
-    db_model = Hero(name="Spider", secret_name="Pak", age=23, team_id=1, city_id=1)
-    db_model2 = Hero(name="Rust", secret_name="Tone", age=37, team_id=2, city_id=2)
-    db_model3 = Hero(name="Aqua", secret_name="Mor", age=42, team_id=1, city_id=3)
-    session.add(db_model)
-    session.add(db_model2)
-    session.add(db_model3)
-    session.commit()
+def create_region(session: Session):
+    rows = [{"name": "Texas"}, {"name": "Washington"}, {"name": "Milwakee"}]
+    insert_batched(session, Region, rows)
 
 
-def create_region():
-    session = next(get_session())
-    db_list: list[Region] = []
-    db_model = Region(name="Texas")
-    db_list.append(db_model)
-    db_model = Region(name="Washington")
-    db_list.append(db_model)
-    db_model = Region(name="Milwakee")
-    db_list.append(db_model)
-    for db_model in db_list:
-        session.add(db_model)
-        session.commit()
-
-
-def create_city():
-    session = next(get_session())
-    db_list: list[City] = []
-    db_model = City(name="Austin", region_id=1)
-    db_list.append(db_model)
-    db_model = City(name="Washington D.C", region_id=2)
-    db_list.append(db_model)
-    db_model = City(name="Wiskonsin", region_id=3)
-    db_list.append(db_model)
-    for db_model in db_list:
-        session.add(db_model)
-        session.commit()
+def create_city(session: Session):
+    rows = [
+        {"name": "Austin", "region_id": 1},
+        {"name": "Washington D.C", "region_id": 2},
+        {"name": "Wiskonsin", "region_id": 3},
+    ]
+    insert_batched(session, City, rows)
 
 
 def get_session():
@@ -166,44 +213,532 @@ def get_session():
         yield session
 
 
-app = FastAPI()
+# ETags of the list and detail reads; the triggers bump hero and team on every write
+table_versions = TableVersions(SQLModel.metadata, get_session, Hero.__table__, Team.__table__)
+conditional_get = table_versions.conditional_get
+
+
+def make_response_cache() -> ResponseCache:
+    size, ttl = config.RESPONSE_CACHE_SIZE, config.RESPONSE_CACHE_TTL
+    if config.RESPONSE_CACHE_BACKEND == "sqlite":
+        return ResponseCache(SQLiteBackend(config.RESPONSE_CACHE_PATH, max_entries=size, ttl=ttl))
+    return ResponseCache(LocalBackend(max_entries=size, ttl=ttl))
+
 
+# Serialized read_hero/read_team bodies keyed by "hero:<id>" and "team:<id>". A team
+# body embeds its heroes and a hero body embeds its team, so writes to either
+# invalidate the entries on both sides.
+response_cache = make_response_cache()
 
-@app.on_event("startup")
-def on_startup():
-    create_db_and_tables()
-    create_region()
-    create_city()
-    create_teams()
-    create_heroes()
+reference = ReferenceCache(Region, City)
+
+
+def cached_json(key: str, response: Response) -> Response | None:
+    body = response_cache.get(key)
+    if body is None:
+        return None
+    return Response(content=body, media_type="application/json", headers=dict(response.headers))
+
+
+def cache_json(key: str, model: type[SQLModel], value, response: Response, since: int) -> Response:
+    # since: response_cache.generation() from before the value was loaded, so a
+    # write that invalidated the key meanwhile keeps this body out of the cache
+    body = model.model_validate(value).model_dump_json().encode()
+    response_cache.set(key, body, since)
+    return Response(content=body, media_type="application/json", headers=dict(response.headers))
+
+
+def hero_team_ids(session: Session, hero_ids: list[int]) -> set[int]:
+    team_ids: set[int] = set()
+    for chunk in chunked(hero_ids):
+        statement = select(Hero.team_id).where(col(Hero.id).in_(chunk))
+        team_ids.update(session.exec(statement).all())
+    return team_ids
+
+
+def missing_teams(session: Session, team_ids: set[int | None]) -> set[int]:
+    # a primary key lookup in the writing transaction: teams change in every worker
+    team_ids.discard(None)
+    found: set[int] = set()
+    for chunk in chunked(list(team_ids)):
+        found.update(session.exec(select(Team.id).where(col(Team.id).in_(chunk))).all())
+    return team_ids - found
+
+
+def team_hero_ids(session: Session, team_ids: list[int]) -> set[int]:
+    hero_ids: set[int] = set()
+    for chunk in chunked(team_ids):
+        statement = select(Hero.id).where(col(Hero.team_id).in_(chunk))
+        hero_ids.update(session.exec(statement).all())
+    return hero_ids
+
+
+def detach_heroes(session: Session, team_ids: list[int]):
+    # what the ORM does for session.delete(team): the team's heroes keep existing
+    session.execute(update(Hero).where(col(Hero.team_id).in_(team_ids)).values(team_id=None))
+
+
+def invalidate(*, hero_ids=(), team_ids=()):
+    response_cache.invalidate(
+        *(f"hero:{hero_id}" for hero_id in hero_ids),
+        *(f"team:{team_id}" for team_id in team_ids if team_id is not None),
+    )
+
+
+def reference_errors(session: Session, rows: list[Row]) -> tuple[list[Row], list[BulkError]]:
+    # foreign keys checked before any row is written, cities against the reference cache
+    unknown_teams = missing_teams(session, {values.get("team_id") for _, values in rows})
+    missing_cities = reference.missing_cities(session, {values["city_id"] for _, values in rows if "city_id" in values})
+    valid, errors = [], []
+    for index, values in rows:
+        if values.get("team_id") in unknown_teams:
+            errors.append(BulkError(index=index, detail="Team not found"))
+        elif values.get("city_id") in missing_cities:
+            errors.append(BulkError(index=index, detail="City not found"))
+        else:
+            valid.append((index, values))
+    return valid, errors
+
+
+def check_references(session: Session, values: dict):
+    _, errors = reference_errors(session, [(0, values)])
+    if errors:
+        raise HTTPException(status_code=422, detail=errors[0].detail)
+
+
+def import_batch(
+    session: Session, lines: list[tuple[int, bytes]]
+) -> tuple[list[int | None], int, list[BulkError]]:
+    rows, errors = validate_lines(lines, HeroCreate)
+    valid, reference_failures = reference_errors(session, rows)
+    errors += reference_failures
+    written, write_errors = write_chunks(session, valid, insert_rows(Hero.__table__, returning=False))
+    team_ids = [values["team_id"] for index, values in valid if index in written]
+    return team_ids, len(written), errors + write_errors
+
+
+EXPORT_BATCH_SIZE = 1000
+
+HERO_COLUMNS = [
+    Hero.id,
+    Hero.name,
+    Hero.secret_name,
+    Hero.age,
+    Hero.team_id,
+    Hero.city_id,
+    Team.name.label("team_name"),
+    Team.headquarters.label("team_headquarters"),
+]
+
+
+def hero_rows_statement():
+    # Plain columns instead of ORM objects, one row per hero, for project_hero().
+    # Nothing is kept in the identity map and no model is validated per row. City
+    # and region come from the reference cache rather than a join.
+    return select(*HERO_COLUMNS).join(Team, col(Hero.team_id) == Team.id, isouter=True)
+
+
+def export_statement(after_id: int | None, before_id: int | None):
+    statement = hero_rows_statement().order_by(Hero.id)
+    if after_id is not None:
+        statement = statement.where(Hero.id > after_id)
+    if before_id is not None:
+        statement = statement.where(Hero.id < before_id)
+    return statement.execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+
+def project_hero(row) -> dict:
+    # the HeroPublicWithTeam shape; unpacking is much cheaper than Row attribute access.
+    # The row's city must already be in the reference cache.
+    hero_id, name, secret_name, age, team_id, city_id, team_name, team_headquarters = row
+    team = None
+    if team_id is not None:
+        team = {"name": team_name, "headquarters": team_headquarters, "id": team_id}
+    return {
+        "name": name,
+        "secret_name": secret_name,
+        "age": age,
+        "team_id": team_id,
+        "city_id": city_id,
+        "id": hero_id,
+        "team": team,
+        "city": reference.city(city_id),
+    }
+
+
+TEAM_COLUMNS = [Team.name, Team.headquarters, Team.id]
+
+
+def project_teams(session: Session, rows) -> list[dict]:
+    # the TeamPublicWithHeroes shape for rows of TEAM_COLUMNS, heroes in one query
+    teams = {
+        team_id: {"name": name, "headquarters": headquarters, "id": team_id, "heroes": []}
+        for name, headquarters, team_id in rows
+    }
+    if teams:
+        statement = hero_rows_statement().where(col(Hero.team_id).in_(list(teams))).order_by(Hero.id)
+        rows = session.exec(statement).all()
+        reference.load(session, {row.city_id for row in rows})
+        for row in rows:
+            teams[row.team_id]["heroes"].append(project_hero(row))
+    return list(teams.values())
+
+
+def stream_export(bind, statement, format: str) -> Iterator[bytes]:
+    # one encoded chunk per fetched batch of rows
+    with Session(bind) as session:
+        result = session.execute(statement)
+        if format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow([*result.keys(), "city_name", "region_id", "region_name"])
+            for partition in result.partitions():
+                reference.load(session, {row.city_id for row in partition})
+                cities = (reference.city(row.city_id) for row in partition)
+                writer.writerows(
+                    (*row, city["name"], city["region_id"], city["region"]["name"])
+                    for row, city in zip(partition, cities)
+                )
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue().encode()
+            return
+        encode = json.JSONEncoder(separators=(",", ":")).encode
+        for partition in result.partitions():
+            reference.load(session, {row.city_id for row in partition})
+            lines = (encode(project_hero(row)) for row in partition)
+            yield ("\n".join(lines) + "\n").encode()
+
+
+loaders = {"joined": joinedload, "selectin": selectinload}
+
+
+def _load(path: str, attribute):
+    return loaders[config.LOADING_STRATEGY[path]](attribute)
+
+
+# hero.city is never loaded for full responses: public_heroes() attaches it from
+# the reference cache
+def hero_load_options():
+    return [_load("team", Hero.team)]
+
+
+def team_load_options():
+    # hero.team is resolved from the identity map, so it needs no loader here
+    return [_load("heroes", Team.heroes)]
+
+
+def public_heroes(session: Session, heroes: list[Hero]) -> list[dict]:
+    # HeroPublicWithTeam input, validated once by the response_model
+    reference.load(session, {hero.city_id for hero in heroes})
+    return [
+        {**hero.model_dump(), "team": hero.team, "city": reference.city(hero.city_id)} for hero in heroes
+    ]
+
+
+def public_teams(session: Session, teams: list[Team]) -> list[dict]:
+    heroes = public_heroes(session, [hero for team in teams for hero in team.heroes])
+    by_team: defaultdict[int, list[dict]] = defaultdict(list)
+    for hero in heroes:
+        by_team[hero["team_id"]].append(hero)
+    return [{**team.model_dump(), "heroes": by_team[team.id]} for team in teams]
+
+
+HERO_RELATIONS = {
+    "team": Relation(Hero.team, TeamPublic, "team", parent_columns=("team_id",)),
+    "city": Relation(
+        Hero.city,
+        CityPublic,
+        "city",
+        parent_columns=("city_id",),
+        children={"region": Relation(City.region, RegionPublic, "city.region", parent_columns=("region_id",))},
+    ),
+}
+
+# a team's heroes do not embed their team again: it is the team being returned
+TEAM_RELATIONS = {
+    "heroes": Relation(
+        Team.heroes, HeroPublic, "heroes", columns=("team_id",), children={"city": HERO_RELATIONS["city"]}
+    ),
+}
+
+
+def relation_options(selection: Selection, relations: dict[str, Relation]) -> list:
+    options = []
+    for name, relation in relations.items():
+        if name in selection:
+            child = selection[name]
+            columns = load_columns(relation.model, child, relation.children, *relation.columns)
+            loader = _load(relation.loader, relation.attribute)
+            options.append(loader.options(load_only(*columns), *relation_options(child, relation.children)))
+    return options
+
+
+def sparse_options(model, selection: Selection, relations: dict[str, Relation], *extra: str) -> list:
+    # only the selected columns, and only the relationships that were asked for
+    columns = load_columns(model, selection, relations, *extra)
+    return [load_only(*columns), *relation_options(selection, relations)]
+
+
+def sparse_json(content, response: Response) -> JSONResponse:
+    return JSONResponse(content=content, headers=dict(response.headers))
+
+
+def hero_counts(session: Session, team_ids: list[int]) -> dict[int, int]:
+    # one GROUP BY over the (team_id, id) index for the whole page of teams
+    statement = select(Hero.team_id, func.count()).where(col(Hero.team_id).in_(team_ids)).group_by(Hero.team_id)
+    return dict(session.exec(statement).all())
+
+
+def hero_previews(session: Session, team_ids: list[int], size: int) -> dict[int, list[dict]]:
+    # the first `size` heroes of every team in one query, whatever the team sizes
+    if not size:
+        return {}
+    position = func.row_number().over(partition_by=Hero.team_id, order_by=Hero.id).label("position")
+    ranked = select(Hero.id, position).where(col(Hero.team_id).in_(team_ids)).subquery()
+    first = select(ranked.c.id).where(ranked.c.position <= size)
+    statement = select(Hero).options(*hero_load_options()).where(col(Hero.id).in_(first)).order_by(Hero.id)
+    previews: defaultdict[int, list[dict]] = defaultdict(list)
+    for hero in public_heroes(session, session.exec(statement).unique().all()):
+        previews[hero["team_id"]].append(hero)
+    return previews
+
+
+def team_previews(session: Session, teams: list[Team], size: int) -> list[dict]:
+    team_ids = [team.id for team in teams]
+    counts = hero_counts(session, team_ids)
+    previews = hero_previews(session, team_ids, size)
+    return [
+        TeamPublicWithPreview.model_validate(
+            team, update={"hero_count": counts.get(team.id, 0), "heroes_preview": previews.get(team.id, [])}
+        ).model_dump(mode="json")
+        for team in teams
+    ]
+
+
+def preview_size(heroes_preview: int | None, fields: str | None, include: str | None) -> int | None:
+    if heroes_preview is not None and (fields is not None or include is not None):
+        raise HTTPException(status_code=400, detail="heroes_preview cannot be combined with fields or include")
+    return heroes_preview
+
+
+def setup_database(session: Session, from_version: int):
+    connection = session.connection()
+    SQLModel.metadata.create_all(connection)
+    # databases created before the version marker already hold the sample data
+    if from_version < 1 and not session.exec(select(Region.id).limit(1)).first():
+        create_region(session)
+        create_city(session)
+        create_teams(session)
+        create_heroes(session)
+    if from_version < 2:
+        create_missing_indexes(connection, Hero.__table__)
+    if from_version < 3:
+        hero_search.create(connection)
+    if from_version < 4:
+        table_versions.create(connection)
+    reference.invalidate()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    initialize(engine, "main", SCHEMA_VERSION, setup_database)
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
+metrics = instrument(app)
 
 
 @app.post("/heroes/", response_model=HeroPublic)
 def create_hero(*, session: Session = Depends(get_session), hero: HeroCreate):
+    check_references(session, hero.model_dump(include={"team_id", "city_id"}))
     db_hero = Hero.model_validate(hero)
     session.add(db_hero)
     session.commit()
     session.refresh(db_hero)
+    response_cache.invalidate(f"hero:{db_hero.id}", f"team:{db_hero.team_id}")
     return db_hero
 
 
-@app.get("/heroes/", response_model=list[HeroPublicWithTeam])
+# registered before /heroes/{hero_id}, which would otherwise take "bulk" for an id
+@app.post("/heroes/bulk", response_model=BulkResult)
+def create_heroes_bulk(
+    *, session: Session = Depends(get_session), heroes: list[Any] = Body(max_length=MAX_ITEMS)
+):
+    rows, errors = validate_items(heroes, HeroCreate)
+    rows, reference_failures = reference_errors(session, rows)
+    written, write_errors = write_chunks(session, rows, insert_rows(Hero.__table__))
+    invalidate(hero_ids=written.values(), team_ids={values.get("team_id") for _, values in rows})
+    return bulk_result(len(heroes), written, errors + reference_failures + write_errors)
+
+
+@app.patch("/heroes/bulk", response_model=BulkResult)
+def update_heroes_bulk(
+    *, session: Session = Depends(get_session), heroes: list[Any] = Body(max_length=MAX_ITEMS)
+):
+    rows, errors = validate_items(heroes, HeroBulkUpdate, exclude_unset=True)
+    rows, reference_failures = reference_errors(session, rows)
+    rows, missing = split_missing(session, Hero.__table__, rows)
+    previous_team_ids = hero_team_ids(session, [values["id"] for _, values in rows])
+    written, write_errors = write_chunks(session, rows, update_rows(Hero.__table__))
+    new_team_ids = {values.get("team_id") for _, values in rows}
+    invalidate(hero_ids=written.values(), team_ids=previous_team_ids | new_team_ids)
+    return bulk_result(len(heroes), written, errors + reference_failures + missing + write_errors)
+
+
+@app.delete("/heroes/bulk", response_model=BulkResult)
+def delete_heroes_bulk(
+    *, session: Session = Depends(get_session), hero_ids: list[int] = Body(max_length=MAX_ITEMS)
+):
+    rows = [(index, {"id": hero_id}) for index, hero_id in enumerate(hero_ids)]
+    rows, missing = split_missing(session, Hero.__table__, rows)
+    team_ids = hero_team_ids(session, [values["id"] for _, values in rows])
+    written, write_errors = write_chunks(session, rows, delete_rows(Hero.__table__))
+    invalidate(hero_ids=written.values(), team_ids=team_ids)
+    return bulk_result(len(hero_ids), written, missing + write_errors)
+
+
+@app.post(
+    "/heroes/import",
+    response_model=ImportResult,
+    openapi_extra={
+        "requestBody": {"required": True, "content": {"application/x-ndjson": {"schema": {"type": "string"}}}}
+    },
+)
+async def import_heroes(*, session: Session = Depends(get_session), request: Request):
+    # One HeroCreate per line. Each batch is committed before the next part of the
+    # body is read, so a slow database slows the upload down instead of buffering it
+    result = ImportResult()
+    team_ids: set[int | None] = set()
+    try:
+        async for lines in ndjson_batches(request.stream()):
+            batch_team_ids, imported, errors = await run_in_threadpool(import_batch, session, lines)
+            team_ids.update(batch_team_ids)
+            result.add(len(lines), imported, errors)
+    finally:
+        if result.imported:
+            invalidate(team_ids=team_ids)
+    return result
+
+
+@app.get(
+    "/heroes/",
+    response_model=list[HeroPublicWithTeam],
+    dependencies=[conditional_get("hero", "team")],
+)
 def read_heroes(
     *,
     session: Session = Depends(get_session),
+    response: Response,
     offset: int = 0,
     limit: int = Query(default=100, le=100),
+    order_by: Literal["id", "name", "age"] = "id",
+    cursor: str | None = None,
+    name_prefix: str | None = None,
+    min_age: int | None = None,
+    max_age: int | None = None,
+    team_id: int | None = None,
+    city_id: int | None = None,
+    fields: str | None = None,
+    include: str | None = None,
 ):
-    heroes = session.exec(select(Hero).offset(offset).limit(limit)).all()
-    return heroes
+    sparse = fields is not None or include is not None
+    fast = config.FAST_JSON and not sparse
+    if sparse:
+        selection = parse_selection(HeroPublic, HERO_RELATIONS, fields, include)
+        statement = select(Hero).options(*sparse_options(Hero, selection, HERO_RELATIONS, order_by))
+    elif fast:
+        statement = hero_rows_statement()
+    else:
+        statement = select(Hero).options(*hero_load_options())
+    statement = filter_heroes(
+        statement,
+        Hero,
+        name_prefix=name_prefix,
+        min_age=min_age,
+        max_age=max_age,
+        team_id=team_id,
+        city_id=city_id,
+    )
+    statement = paginate(
+        statement,
+        Hero,
+        order_by=order_by,
+        cursor=cursor,
+        offset=offset,
+        limit=limit,
+    )
+    heroes = session.exec(statement).all() if fast else session.exec(statement).unique().all()
+    if next_page := next_cursor(heroes, order_by=order_by, limit=limit):
+        response.headers["X-Next-Cursor"] = next_page
+    if sparse:
+        return sparse_json([dump(hero, selection) for hero in heroes], response)
+    if fast:
+        reference.load(session, {row.city_id for row in heroes})
+        return fast_json([project_hero(row) for row in heroes], response)
+    return public_heroes(session, heroes)
+
+
+@app.get("/heroes/export")
+def export_heroes(
+    *,
+    session: Session = Depends(get_session),
+    format: Literal["ndjson", "csv"] = "ndjson",
+    after_id: int | None = None,
+    before_id: int | None = None,
+):
+    # the stream outlives this handler, so it runs on a session of its own
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    statement = export_statement(after_id, before_id)
+    return StreamingResponse(stream_export(session.get_bind(), statement, format), media_type=media_type)
+
+
+@app.get(
+    "/heroes/search",
+    response_model=list[HeroPublic],
+    dependencies=[conditional_get("hero")],
+)
+def search_heroes(
+    *,
+    session: Session = Depends(get_session),
+    q: str = Query(min_length=3),
+    offset: int = 0,
+    limit: int = Query(default=100, le=100),
+):
+    statement = hero_search.search(select(Hero), Hero.id, q)
+    return session.exec(statement.offset(offset).limit(limit)).all()
 
 
-@app.get("/heroes/{hero_id}", response_model=HeroPublicWithTeam)
-def read_hero(*, session: Session = Depends(get_session), hero_id: int):
-    hero = session.get(Hero, hero_id)
+@app.get(
+    "/heroes/{hero_id}",
+    response_model=HeroPublicWithTeam,
+    dependencies=[conditional_get("hero", "team")],
+)
+def read_hero(
+    *,
+    session: Session = Depends(get_session),
+    response: Response,
+    hero_id: int,
+    fields: str | None = None,
+    include: str | None = None,
+):
+    # sparse bodies are not cached: only the full one is invalidated on writes
+    if fields is not None or include is not None:
+        selection = parse_selection(HeroPublic, HERO_RELATIONS, fields, include)
+        hero = session.get(Hero, hero_id, options=sparse_options(Hero, selection, HERO_RELATIONS))
+        if not hero:
+            raise HTTPException(status_code=404, detail="Hero not found")
+        return sparse_json(dump(hero, selection), response)
+    if cached := cached_json(f"hero:{hero_id}", response):
+        return cached
+    since = response_cache.generation()
+    hero = session.get(Hero, hero_id, options=hero_load_options())
     if not hero:
         raise HTTPException(status_code=404, detail="Hero not found")
-    return hero
+    return cache_json(f"hero:{hero_id}", HeroPublicWithTeam, public_heroes(session, [hero])[0], response, since)
 
 
 @app.patch("/heroes/{hero_id}", response_model=HeroPublic)
@@ -213,11 +748,16 @@ def update_hero(
     db_hero = session.get(Hero, hero_id)
     if not db_hero:
         raise HTTPException(status_code=404, detail="Hero not found")
+    previous_team_id = db_hero.team_id
     hero_data = hero.model_dump(exclude_unset=True)
+    check_references(session, hero_data)
     db_hero.sqlmodel_update(hero_data)
     session.add(db_hero)
     session.commit()
     session.refresh(db_hero)
+    response_cache.invalidate(
+        f"hero:{hero_id}", f"team:{previous_team_id}", f"team:{db_hero.team_id}"
+    )
     return db_hero
 
 
@@ -228,9 +768,15 @@ def delete_hero(*, session: Session = Depends(get_session), hero_id: int):
         raise HTTPException(status_code=404, detail="Hero not found")
     session.delete(hero)
     session.commit()
+    response_cache.invalidate(f"hero:{hero_id}", f"team:{hero.team_id}")
     return {"ok": True}
 
 
+@app.get("/cache/stats")
+def read_cache_stats():
+    return response_cache.stats()
+
+
 @app.post("/teams/", response_model=TeamPublic)
 def create_team(*, session: Session = Depends(get_session), team: TeamCreate):
     db_team = Team.model_validate(team)
@@ -240,23 +786,154 @@ def create_team(*, session: Session = Depends(get_session), team: TeamCreate):
     return db_team
 
 
-@app.get("/teams/", response_model=list[TeamPublicWithHeroes])
+@app.post("/teams/bulk", response_model=BulkResult)
+def create_teams_bulk(
+    *, session: Session = Depends(get_session), teams: list[Any] = Body(max_length=MAX_ITEMS)
+):
+    rows, errors = validate_items(teams, TeamCreate)
+    written, write_errors = write_chunks(session, rows, insert_rows(Team.__table__))
+    invalidate(team_ids=written.values())
+    return bulk_result(len(teams), written, errors + write_errors)
+
+
+@app.patch("/teams/bulk", response_model=BulkResult)
+def update_teams_bulk(
+    *, session: Session = Depends(get_session), teams: list[Any] = Body(max_length=MAX_ITEMS)
+):
+    rows, errors = validate_items(teams, TeamBulkUpdate, exclude_unset=True)
+    rows, missing = split_missing(session, Team.__table__, rows)
+    written, write_errors = write_chunks(session, rows, update_rows(Team.__table__))
+    team_ids = list(written.values())
+    invalidate(hero_ids=team_hero_ids(session, team_ids), team_ids=team_ids)
+    return bulk_result(len(teams), written, errors + missing + write_errors)
+
+
+@app.delete("/teams/bulk", response_model=BulkResult)
+def delete_teams_bulk(
+    *, session: Session = Depends(get_session), team_ids: list[int] = Body(max_length=MAX_ITEMS)
+):
+    rows = [(index, {"id": team_id}) for index, team_id in enumerate(team_ids)]
+    rows, missing = split_missing(session, Team.__table__, rows)
+    hero_ids = team_hero_ids(session, [values["id"] for _, values in rows])
+    write = delete_rows(Team.__table__, before=detach_heroes)
+    written, write_errors = write_chunks(session, rows, write)
+    invalidate(hero_ids=hero_ids, team_ids=written.values())
+    return bulk_result(len(team_ids), written, missing + write_errors)
+
+
+@app.get(
+    "/teams/",
+    response_model=list[TeamResponse],
+    dependencies=[conditional_get("team", "hero")],
+)
 def read_teams(
     *,
     session: Session = Depends(get_session),
+    response: Response,
     offset: int = 0,
     limit: int = Query(default=100, le=100),
+    order_by: Literal["id", "name"] = "id",
+    cursor: str | None = None,
+    fields: str | None = None,
+    include: str | None = None,
+    heroes_preview: int | None = Query(default=None, ge=0, le=100),
 ):
-    teams = session.exec(select(Team).offset(offset).limit(limit)).all()
-    return teams
+    # heroes_preview=N embeds each team's first N heroes and its hero_count instead
+    # of the full hero list
+    preview = preview_size(heroes_preview, fields, include)
+    sparse = fields is not None or include is not None
+    fast = config.FAST_JSON and not sparse and preview is None
+    if sparse:
+        selection = parse_selection(TeamPublic, TEAM_RELATIONS, fields, include)
+        statement = select(Team).options(*sparse_options(Team, selection, TEAM_RELATIONS, order_by))
+    elif fast:
+        statement = select(*TEAM_COLUMNS)
+    elif preview is not None:
+        statement = select(Team)
+    else:
+        statement = select(Team).options(*team_load_options())
+    statement = paginate(
+        statement,
+        Team,
+        order_by=order_by,
+        cursor=cursor,
+        offset=offset,
+        limit=limit,
+    )
+    teams = session.exec(statement).all() if fast else session.exec(statement).unique().all()
+    if next_page := next_cursor(teams, order_by=order_by, limit=limit):
+        response.headers["X-Next-Cursor"] = next_page
+    if sparse:
+        return sparse_json([dump(team, selection) for team in teams], response)
+    if fast:
+        return fast_json(project_teams(session, teams), response)
+    if preview is not None:
+        return sparse_json(team_previews(session, teams, preview), response)
+    return public_teams(session, teams)
+
+
+@app.get(
+    "/teams/{team_id}",
+    response_model=TeamResponse,
+    dependencies=[conditional_get("team", "hero")],
+)
+def read_team(
+    *,
+    team_id: int,
+    session: Session = Depends(get_session),
+    response: Response,
+    fields: str | None = None,
+    include: str | None = None,
+    heroes_preview: int | None = Query(default=None, ge=0, le=100),
+):
+    if (preview := preview_size(heroes_preview, fields, include)) is not None:
+        team = session.get(Team, team_id)
+        if not team:
+            raise HTTPException(status_code=404, detail="Team not found")
+        return sparse_json(team_previews(session, [team], preview)[0], response)
+    if fields is not None or include is not None:
+        selection = parse_selection(TeamPublic, TEAM_RELATIONS, fields, include)
+        team = session.get(Team, team_id, options=sparse_options(Team, selection, TEAM_RELATIONS))
+        if not team:
+            raise HTTPException(status_code=404, detail="Team not found")
+        return sparse_json(dump(team, selection), response)
+    if cached := cached_json(f"team:{team_id}", response):
+        return cached
+    since = response_cache.generation()
+    team = session.get(Team, team_id, options=team_load_options())
+    if not team:
+        raise HTTPException(status_code=404, detail="Team not found")
+    return cache_json(f"team:{team_id}", TeamPublicWithHeroes, public_teams(session, [team])[0], response, since)
 
 
-@app.get("/teams/{team_id}", response_model=TeamPublicWithHeroes)
-def read_team(*, team_id: int, session: Session = Depends(get_session)):
-    team = session.get(Team, team_id)
-    if not team:
+@app.get(
+    "/teams/{team_id}/heroes",
+    response_model=list[HeroPublicWithTeam],
+    dependencies=[conditional_get("team", "hero")],
+)
+def read_team_heroes(
+    *,
+    session: Session = Depends(get_session),
+    response: Response,
+    team_id: int,
+    limit: int = Query(default=100, le=100),
+    order_by: Literal["id", "name", "age"] = "id",
+    cursor: str | None = None,
+):
+    if not session.get(Team, team_id):
         raise HTTPException(status_code=404, detail="Team not found")
-    return team
+    statement = paginate(
+        select(Hero).options(*hero_load_options()).where(Hero.team_id == team_id),
+        Hero,
+        order_by=order_by,
+        cursor=cursor,
+        offset=0,
+        limit=limit,
+    )
+    heroes = session.exec(statement).unique().all()
+    if next_page := next_cursor(heroes, order_by=order_by, limit=limit):
+        response.headers["X-Next-Cursor"] = next_page
+    return public_heroes(session, heroes)
 
 
 @app.patch("/teams/{team_id}", response_model=TeamPublic)
@@ -274,6 +951,8 @@ def update_team(
     session.add(db_team)
     session.commit()
     session.refresh(db_team)
+    hero_ids = session.exec(select(Hero.id).where(Hero.team_id == team_id)).all()
+    response_cache.invalidate(f"team:{team_id}", *(f"hero:{hero_id}" for hero_id in hero_ids))
     return db_team
 
 
@@ -282,6 +961,13 @@ def delete_team(*, session: Session = Depends(get_session), team_id: int):
     team = session.get(Team, team_id)
     if not team:
         raise HTTPException(status_code=404, detail="Team not found")
+    hero_ids = [hero.id for hero in team.heroes]
     session.delete(team)
     session.commit()
+    response_cache.invalidate(f"team:{team_id}", *(f"hero:{hero_id}" for hero_id in hero_ids))
     return {"ok": True}
+
+
+if config.DB_MODE == "async":
+    # main_async reuses the models above, so it can only be imported at the end
+    from .main_async import app  # noqa: E402,F811
@@ -0,0 +1,347 @@
+import asyncio
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
+from typing import Literal
+
+from fastapi import Depends, FastAPI, HTTPException, Query, Response
+from sqlalchemy.orm import selectinload
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from . import main
+from .engines import async_sqlite_engine
+from .filters import filter_heroes
+from .instrumentation import instrument
+from .keyset import next_cursor, paginate
+from .main import (
+    HERO_RELATIONS,
+    TEAM_RELATIONS,
+    Hero,
+    HeroCreate,
+    HeroPublic,
+    HeroPublicWithTeam,
+    HeroUpdate,
+    Team,
+    TeamCreate,
+    TeamPublic,
+    TeamPublicWithHeroes,
+    TeamResponse,
+    TeamUpdate,
+    cache_json,
+    cached_json,
+    check_references,
+    hero_load_options,
+    preview_size,
+    public_heroes,
+    public_teams,
+    response_cache,
+    sparse_json,
+    sparse_options,
+    table_versions,
+    team_load_options,
+    team_previews,
+)
+from .response_cache import LocalBackend
+from .seed import initialize
+from .sparse import dump, parse_selection
+
+# Same database as main.py, reached through aiosqlite so handlers never block a thread.
+# Lazy loading is not possible on an AsyncSession: every relationship a response
+# needs is eager loaded explicitly, and cities come from main's reference cache,
+# reached through run_sync.
+#
+# The single-row CRUD and the /heroes/ and /teams/ listings below are async, with
+# the same query parameters, ETags and response cache as main.py. Every other route
+# (bulk writes, import, export, search, /teams/{team_id}/heroes, /cache/stats) is
+# main.py's own sync handler, running on Starlette's threadpool: see the end of
+# this module.
+async_sqlite_url = f"sqlite+aiosqlite:///{main.sqlite_file_name}"
+engine = async_sqlite_engine(async_sqlite_url, pool_size=20)
+
+
+async def get_session() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        yield session
+
+
+def conditional_get(*tables: str):
+    # the version lookup runs on the request's AsyncSession, like the handler
+    return table_versions.async_conditional_get(get_session, *tables)
+
+
+async def off_loop(fn, *args):
+    # LocalBackend calls only touch memory. SQLiteBackend's are file I/O, so they go
+    # to the event loop's default executor rather than block it or take a thread
+    # from Starlette's capped pool.
+    if isinstance(response_cache.backend, LocalBackend):
+        return fn(*args)
+    return await asyncio.to_thread(fn, *args)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    initialize(main.engine, "main", main.SCHEMA_VERSION, main.setup_database)
+    yield
+    await engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+metrics = instrument(app)
+
+
+@app.post("/heroes/", response_model=HeroPublic)
+async def create_hero(*, session: AsyncSession = Depends(get_session), hero: HeroCreate):
+    await session.run_sync(check_references, hero.model_dump(include={"team_id", "city_id"}))
+    db_hero = Hero.model_validate(hero)
+    session.add(db_hero)
+    await session.commit()
+    await session.refresh(db_hero)
+    await off_loop(response_cache.invalidate, f"hero:{db_hero.id}", f"team:{db_hero.team_id}")
+    return db_hero
+
+
+@app.get(
+    "/heroes/",
+    response_model=list[HeroPublicWithTeam],
+    dependencies=[conditional_get("hero", "team")],
+)
+async def read_heroes(
+    *,
+    session: AsyncSession = Depends(get_session),
+    response: Response,
+    offset: int = 0,
+    limit: int = Query(default=100, le=100),
+    order_by: Literal["id", "name", "age"] = "id",
+    cursor: str | None = None,
+    name_prefix: str | None = None,
+    min_age: int | None = None,
+    max_age: int | None = None,
+    team_id: int | None = None,
+    city_id: int | None = None,
+    fields: str | None = None,
+    include: str | None = None,
+):
+    sparse = fields is not None or include is not None
+    if sparse:
+        selection = parse_selection(HeroPublic, HERO_RELATIONS, fields, include)
+        statement = select(Hero).options(*sparse_options(Hero, selection, HERO_RELATIONS, order_by))
+    else:
+        statement = select(Hero).options(*hero_load_options())
+    statement = filter_heroes(
+        statement,
+        Hero,
+        name_prefix=name_prefix,
+        min_age=min_age,
+        max_age=max_age,
+        team_id=team_id,
+        city_id=city_id,
+    )
+    statement = paginate(
+        statement,
+        Hero,
+        order_by=order_by,
+        cursor=cursor,
+        offset=offset,
+        limit=limit,
+    )
+    heroes = (await session.exec(statement)).unique().all()
+    if next_page := next_cursor(heroes, order_by=order_by, limit=limit):
+        response.headers["X-Next-Cursor"] = next_page
+    if sparse:
+        return sparse_json([dump(hero, selection) for hero in heroes], response)
+    return await session.run_sync(public_heroes, heroes)
+
+
+@app.get(
+    "/heroes/{hero_id}",
+    response_model=HeroPublicWithTeam,
+    dependencies=[conditional_get("hero", "team")],
+)
+async def read_hero(
+    *,
+    session: AsyncSession = Depends(get_session),
+    response: Response,
+    hero_id: int,
+    fields: str | None = None,
+    include: str | None = None,
+):
+    if fields is not None or include is not None:
+        selection = parse_selection(HeroPublic, HERO_RELATIONS, fields, include)
+        hero = await session.get(Hero, hero_id, options=sparse_options(Hero, selection, HERO_RELATIONS))
+        if not hero:
+            raise HTTPException(status_code=404, detail="Hero not found")
+        return sparse_json(dump(hero, selection), response)
+    if cached := await off_loop(cached_json, f"hero:{hero_id}", response):
+        return cached
+    since = await off_loop(response_cache.generation)
+    hero = await session.get(Hero, hero_id, options=hero_load_options())
+    if not hero:
+        raise HTTPException(status_code=404, detail="Hero not found")
+    value = (await session.run_sync(public_heroes, [hero]))[0]
+    return await off_loop(cache_json, f"hero:{hero_id}", HeroPublicWithTeam, value, response, since)
+
+
+@app.patch("/heroes/{hero_id}", response_model=HeroPublic)
+async def update_hero(
+    *, session: AsyncSession = Depends(get_session), hero_id: int, hero: HeroUpdate
+):
+    db_hero = await session.get(Hero, hero_id)
+    if not db_hero:
+        raise HTTPException(status_code=404, detail="Hero not found")
+    previous_team_id = db_hero.team_id
+    hero_data = hero.model_dump(exclude_unset=True)
+    await session.run_sync(check_references, hero_data)
+    db_hero.sqlmodel_update(hero_data)
+    session.add(db_hero)
+    await session.commit()
+    await session.refresh(db_hero)
+    await off_loop(
+        response_cache.invalidate, f"hero:{hero_id}", f"team:{previous_team_id}", f"team:{db_hero.team_id}"
+    )
+    return db_hero
+
+
+@app.delete("/heroes/{hero_id}")
+async def delete_hero(*, session: AsyncSession = Depends(get_session), hero_id: int):
+    hero = await session.get(Hero, hero_id)
+    if not hero:
+        raise HTTPException(status_code=404, detail="Hero not found")
+    await session.delete(hero)
+    await session.commit()
+    await off_loop(response_cache.invalidate, f"hero:{hero_id}", f"team:{hero.team_id}")
+    return {"ok": True}
+
+
+@app.post("/teams/", response_model=TeamPublic)
+async def create_team(*, session: AsyncSession = Depends(get_session), team: TeamCreate):
+    db_team = Team.model_validate(team)
+    session.add(db_team)
+    await session.commit()
+    await session.refresh(db_team)
+    return db_team
+
+
+@app.get(
+    "/teams/",
+    response_model=list[TeamResponse],
+    dependencies=[conditional_get("team", "hero")],
+)
+async def read_teams(
+    *,
+    session: AsyncSession = Depends(get_session),
+    response: Response,
+    offset: int = 0,
+    limit: int = Query(default=100, le=100),
+    order_by: Literal["id", "name"] = "id",
+    cursor: str | None = None,
+    fields: str | None = None,
+    include: str | None = None,
+    heroes_preview: int | None = Query(default=None, ge=0, le=100),
+):
+    preview = preview_size(heroes_preview, fields, include)
+    sparse = fields is not None or include is not None
+    if sparse:
+        selection = parse_selection(TeamPublic, TEAM_RELATIONS, fields, include)
+        statement = select(Team).options(*sparse_options(Team, selection, TEAM_RELATIONS, order_by))
+    elif preview is not None:
+        statement = select(Team)
+    else:
+        statement = select(Team).options(*team_load_options())
+    statement = paginate(
+        statement,
+        Team,
+        order_by=order_by,
+        cursor=cursor,
+        offset=offset,
+        limit=limit,
+    )
+    teams = (await session.exec(statement)).unique().all()
+    if next_page := next_cursor(teams, order_by=order_by, limit=limit):
+        response.headers["X-Next-Cursor"] = next_page
+    if sparse:
+        return sparse_json([dump(team, selection) for team in teams], response)
+    if preview is not None:
+        return sparse_json(await session.run_sync(team_previews, teams, preview), response)
+    return await session.run_sync(public_teams, teams)
+
+
+@app.get(
+    "/teams/{team_id}",
+    response_model=TeamResponse,
+    dependencies=[conditional_get("team", "hero")],
+)
+async def read_team(
+    *,
+    team_id: int,
+    session: AsyncSession = Depends(get_session),
+    response: Response,
+    fields: str | None = None,
+    include: str | None = None,
+    heroes_preview: int | None = Query(default=None, ge=0, le=100),
+):
+    if (preview := preview_size(heroes_preview, fields, include)) is not None:
+        team = await session.get(Team, team_id)
+        if not team:
+            raise HTTPException(status_code=404, detail="Team not found")
+        return sparse_json((await session.run_sync(team_previews, [team], preview))[0], response)
+    if fields is not None or include is not None:
+        selection = parse_selection(TeamPublic, TEAM_RELATIONS, fields, include)
+        team = await session.get(Team, team_id, options=sparse_options(Team, selection, TEAM_RELATIONS))
+        if not team:
+            raise HTTPException(status_code=404, detail="Team not found")
+        return sparse_json(dump(team, selection), response)
+    if cached := await off_loop(cached_json, f"team:{team_id}", response):
+        return cached
+    since = await off_loop(response_cache.generation)
+    team = await session.get(Team, team_id, options=team_load_options())
+    if not team:
+        raise HTTPException(status_code=404, detail="Team not found")
+    value = (await session.run_sync(public_teams, [team]))[0]
+    return await off_loop(cache_json, f"team:{team_id}", TeamPublicWithHeroes, value, response, since)
+
+
+@app.patch("/teams/{team_id}", response_model=TeamPublic)
+async def update_team(
+    *,
+    session: AsyncSession = Depends(get_session),
+    team_id: int,
+    team: TeamUpdate,
+):
+    db_team = await session.get(Team, team_id)
+    if not db_team:
+        raise HTTPException(status_code=404, detail="Team not found")
+    team_data = team.model_dump(exclude_unset=True)
+    db_team.sqlmodel_update(team_data)
+    session.add(db_team)
+    await session.commit()
+    await session.refresh(db_team)
+    hero_ids = (await session.exec(select(Hero.id).where(Hero.team_id == team_id))).all()
+    keys = [f"team:{team_id}", *(f"hero:{hero_id}" for hero_id in hero_ids)]
+    await off_loop(response_cache.invalidate, *keys)
+    return db_team
+
+
+@app.delete("/teams/{team_id}")
+async def delete_team(*, session: AsyncSession = Depends(get_session), team_id: int):
+    # deleting a team detaches its heroes, so they have to be loaded up front
+    team = await session.get(Team, team_id, options=[selectinload(Team.heroes)])
+    if not team:
+        raise HTTPException(status_code=404, detail="Team not found")
+    hero_ids = [hero.id for hero in team.heroes]
+    await session.delete(team)
+    await session.commit()
+    keys = [f"team:{team_id}", *(f"hero:{hero_id}" for hero_id in hero_ids)]
+    await off_loop(response_cache.invalidate, *keys)
+    return {"ok": True}
+
+
+def route_key(route) -> tuple[str, frozenset[str]]:
+    return route.path, frozenset(getattr(route, "methods", None) or ())
+
+
+# Everything main.py serves that is not defined above is delegated to its sync
+# handler. The routes are laid out in main.py's order, so /heroes/bulk, /heroes/export
+# and the like still come before /heroes/{hero_id}.
+native = {route_key(route): route for route in app.router.routes}
+app.router.routes = [native.pop(route_key(route), route) for route in main.app.router.routes]
+app.router.routes += native.values()
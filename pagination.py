@@ -1,9 +1,22 @@
+from contextlib import asynccontextmanager
+from typing import Literal
+
 from fastapi import FastAPI, HTTPException, Query
-from sqlmodel import Field, Session, SQLModel, create_engine, select, func, col
+from sqlmodel import Field, Session, SQLModel, select, func
 
-import string
+import math
 import random
 
+from . import config
+from .count_cache import CountCache
+from .engines import sqlite_engine
+from .etag import TableVersions
+from .fast_json import fast_json
+from .filters import filter_heroes
+from .instrumentation import instrument
+from .keyset import next_cursor, paginate
+from .seed import hero_rows, initialize, insert_batched
+
 
 class HeroBase(SQLModel):
     name: str = Field(index=True)
@@ -23,38 +36,60 @@ class HeroPublic(HeroBase):
     id: int
 
 
+class HeroPage(SQLModel):
+    page: int
+    per_page: int
+    total: int
+    pages: int
+    items: list[HeroPublic]
+    next_cursor: str | None = None
+
+
 sqlite_file_name = "database.db"
 sqlite_url = f"sqlite:///{sqlite_file_name}"
 
-connect_args = {"check_same_thread": False}
-engine = create_engine(sqlite_url, echo=True, connect_args=connect_args)
+engine = sqlite_engine(sqlite_url, pool_size=40)
 
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+# The hero table's write counter, moved by triggers in whichever process writes, so
+# a cached total is recomputed after any worker's insert. No conditional GETs here.
+table_versions = TableVersions(SQLModel.metadata, None, Hero.__table__)
 
-def id_generator(size: int=6, chars:str=string.ascii_uppercase + string.digits):
-    return ''.join(random.choice(chars) for _ in range(size))
+count_cache = CountCache(ttl=config.COUNT_TTL)
 
-def create_data():
-    with Session(engine) as session:
-        for _ in range(50):
-            model_db = Hero(
-                name=id_generator(),
-                secret_name=id_generator(),
-                age=random.randint(0,100)
-            )
-            session.add(model_db)
-            session.commit()
+SCHEMA_VERSION = 2
+
+
+def count_heroes(session: Session, **filters) -> int:
+    filtered = any(value is not None for value in filters.values())
+    if config.COUNT_MODE == "estimated" and not filtered:
+        # MAX(id) is a single b-tree seek; it overshoots only by deleted rows
+        return session.exec(select(func.max(Hero.id))).one() or 0
+    statement = filter_heroes(select(func.count()).select_from(Hero), Hero, **filters)
+    return session.exec(statement).one()
 
-app = FastAPI()
 
+def create_data(session: Session, count: int = 50):
+    insert_batched(session, Hero, hero_rows(count, random.Random()))
 
-@app.on_event("startup")
-def on_startup():
-    create_db_and_tables()
 
-    create_data()
+def setup_database(session: Session, from_version: int):
+    connection = session.connection()
+    SQLModel.metadata.create_all(connection)
+    if from_version < 1:
+        create_data(session)
+    if from_version < 2:
+        table_versions.create(connection)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    initialize(engine, "pagination", SCHEMA_VERSION, setup_database)
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
+metrics = instrument(app)
 
 
 @app.post("/heroes/", response_model=HeroPublic)
@@ -64,31 +99,62 @@ def create_hero(hero: HeroCreate):
         session.add(db_hero)
         session.commit()
         session.refresh(db_hero)
+        count_cache.invalidate()
         return db_hero
 
 
 @app.get(
         "/heroes/",
-        response_model=list[HeroPublic]
+        response_model=HeroPage
         )
-def read_heroes(page: int = Query(default=1, ge=1), per_page: int = Query(alias="per-page", default=100, le=100, ge=0)):
+def read_heroes(
+    page: int = Query(default=1, ge=1),
+    per_page: int = Query(alias="per-page", default=100, le=100, ge=0),
+    order_by: Literal["id", "name", "age"] = "id",
+    cursor: str | None = None,
+    name_prefix: str | None = None,
+    min_age: int | None = None,
+    max_age: int | None = None,
+):
+    filters = {"name_prefix": name_prefix, "min_age": min_age, "max_age": max_age}
     with Session(engine) as session:
-        count_statement = select(func.count()).select_from(Hero).where(col(Hero.age) > 0)
-        total = session.exec(count_statement).one()
-        
-        pages = (total // per_page) + 1
-        page = page - 1
-        offset = per_page * page
-        
-        heroes = session.exec(select(Hero).offset(offset).limit(per_page)).all()
-        return heroes
-        return {
+        if any(value is not None for value in filters.values()):
+            # not cached: every distinct filter would add an entry
+            total = count_heroes(session, **filters)
+        else:
+            # the version is read first: a write after it moves it past the cached total
+            version = table_versions.versions(session, ("hero",)).get("hero", 0)
+            total = count_cache.get("heroes", lambda: count_heroes(session), version)
+        pages = math.ceil(total / per_page) if per_page else 0
+        # with a cursor the page number is ignored and the page starts after it
+        offset = 0 if cursor else per_page * (page - 1)
+
+        # with HEROES_FAST_JSON, plain HeroPublic column rows encoded without validation
+        columns = select(Hero.name, Hero.secret_name, Hero.age, Hero.id) if config.FAST_JSON else select(Hero)
+        statement = paginate(
+            filter_heroes(columns, Hero, **filters),
+            Hero,
+            order_by=order_by,
+            cursor=cursor,
+            offset=offset,
+            limit=per_page,
+        )
+        heroes = session.exec(statement).all()
+        body = {
             "page": page,
             "per_page": per_page,
             "total": total,
             "pages": pages,
+            "items": heroes,
+            "next_cursor": next_cursor(heroes, order_by=order_by, limit=per_page),
         }
-
+        if config.FAST_JSON:
+            body["items"] = [
+                {"name": name, "secret_name": secret_name, "age": age, "id": hero_id}
+                for name, secret_name, age, hero_id in heroes
+            ]
+            return fast_json(body)
+        return body
 
 
 @app.get("/heroes/{hero_id}", response_model=HeroPublic)
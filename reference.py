@@ -0,0 +1,58 @@
+import threading
+from collections.abc import Iterable
+
+from sqlalchemy import select
+from sqlmodel import Session
+
+
+class ReferenceCache:
+    # Region and City rows by id, read once per process and shared by every request.
+    # They are small and change rarely: setup calls invalidate(), and an id that is
+    # not cached, e.g. one the seed CLI added, reloads them.
+    # Cities are kept in the CityPublicWithRelations shape, so responses embed them
+    # without joining city and region. Teams are not kept here: any worker can
+    # create or delete one, so hero writes look their team up in the database.
+    def __init__(self, region_model, city_model):
+        self.region_model = region_model
+        self.city_model = city_model
+        self.version = 0
+        self._lock = threading.Lock()
+        self._cities: dict[int, dict] | None = None
+
+    def invalidate(self):
+        with self._lock:
+            self._cities = None
+            self.version += 1
+
+    def load(self, session: Session, city_ids: Iterable[int] = ()):
+        # a city id that is not cached means the table changed behind our back: reload
+        city_ids = set(city_ids)
+        if self._loaded(city_ids):
+            return
+        with self._lock:
+            if self._loaded(city_ids):
+                return
+            Region, City = self.region_model, self.city_model
+            regions = {
+                region_id: {"name": name, "id": region_id}
+                for region_id, name in session.execute(select(Region.id, Region.name))
+            }
+            rows = session.execute(select(City.id, City.name, City.region_id))
+            self._cities = {
+                city_id: {"name": name, "region_id": region_id, "id": city_id, "region": regions[region_id]}
+                for city_id, name, region_id in rows
+            }
+
+    def _loaded(self, city_ids: set[int]) -> bool:
+        return self._cities is not None and city_ids.issubset(self._cities)
+
+    def city(self, city_id: int) -> dict:
+        # callers load() the ids they are about to embed first
+        return self._cities[city_id]
+
+    def missing_cities(self, session: Session, city_ids: Iterable[int]) -> set[int]:
+        # an unknown id reloads once, like a read would: another process (the seed
+        # CLI) may have added the city
+        city_ids = set(city_ids)
+        self.load(session, city_ids)
+        return {city_id for city_id in city_ids if city_id not in self._cities}
@@ -0,0 +1,224 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Protocol
+
+
+# Read-through fills race with invalidation: a reader that loaded a row before a
+# write committed must not store its body after the write invalidated the key.
+# Every invalidation advances a generation; a reader takes generation() before its
+# query and passes it to set(), which skips the store when the key has been
+# invalidated since. Invalidations are remembered for as many keys as the cache
+# holds entries; a reader older than the oldest one forgotten stores nothing.
+class CacheBackend(Protocol):
+    evictions: int
+
+    def get(self, key: str) -> bytes | None: ...
+
+    def generation(self) -> int: ...
+
+    def set(self, key: str, value: bytes, since: int | None = None) -> bool: ...
+
+    def delete(self, *keys: str) -> None: ...
+
+    def clear(self) -> None: ...
+
+    def __len__(self) -> int: ...
+
+
+class LocalBackend:
+    # In-process LRU with an optional TTL; each worker process has its own copy
+    def __init__(self, max_entries: int = 10_000, ttl: float | None = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._entries: OrderedDict[str, tuple[bytes, float]] = OrderedDict()
+        self._generation = 0
+        # key -> generation of its last invalidation, oldest first
+        self._invalidated: OrderedDict[str, int] = OrderedDict()
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self.ttl is not None and time.monotonic() - entry[1] >= self.ttl:
+                del self._entries[key]
+                self.evictions += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def generation(self) -> int:
+        return self._generation
+
+    def set(self, key: str, value: bytes, since: int | None = None) -> bool:
+        with self._lock:
+            if since is not None and (since < self._floor or self._invalidated.get(key, 0) > since):
+                return False
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return True
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+                self._invalidated[key] = self._generation
+                self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.max_entries:
+                _, self._floor = self._invalidated.popitem(last=False)
+
+    def clear(self) -> None:
+        # everything was invalidated: no read from before this may store
+        with self._lock:
+            self._entries.clear()
+            self._invalidated.clear()
+            self._generation += 1
+            self._floor = self._generation
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    # Stand-in for a shared cache such as Redis: every worker on the host opens the
+    # same file, so an invalidation in one worker is seen by all of them
+    def __init__(self, path: str, max_entries: int = 10_000, ttl: float | None = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._local = threading.local()
+        self._path = path
+        connection = self._connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, stored REAL NOT NULL)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS invalidation (key TEXT PRIMARY KEY, generation INTEGER NOT NULL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS ix_invalidation_generation ON invalidation (generation)")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache_state (id INTEGER PRIMARY KEY CHECK (id = 0), "
+            "generation INTEGER NOT NULL, floor INTEGER NOT NULL)"
+        )
+        connection.execute("INSERT OR IGNORE INTO cache_state VALUES (0, 0, 0)")
+
+    def _connection(self) -> sqlite3.Connection:
+        if not hasattr(self._local, "connection"):
+            connection = sqlite3.connect(self._path, isolation_level=None, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            self._local.connection = connection
+        return self._local.connection
+
+    def get(self, key: str) -> bytes | None:
+        row = self._connection().execute("SELECT value, stored FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if self.ttl is not None and time.time() - row[1] >= self.ttl:
+            self.delete(key)
+            self.evictions += 1
+            return None
+        return row[0]
+
+    def generation(self) -> int:
+        return self._connection().execute("SELECT generation FROM cache_state").fetchone()[0]
+
+    def set(self, key: str, value: bytes, since: int | None = None) -> bool:
+        connection = self._connection()
+        # one statement, so no other worker's invalidation can land between check and write
+        stored = connection.execute(
+            "INSERT OR REPLACE INTO cache SELECT :key, :value, :stored WHERE :since IS NULL OR ("
+            ":since >= (SELECT floor FROM cache_state) AND "
+            "NOT EXISTS (SELECT 1 FROM invalidation WHERE key = :key AND generation > :since))",
+            {"key": key, "value": value, "stored": time.time(), "since": since},
+        ).rowcount
+        if not stored:
+            return False
+        overflow = len(self) - self.max_entries
+        if overflow > 0:
+            # oldest writes go first; reads are not tracked, to keep get() read-only
+            connection.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY stored LIMIT ?)", (overflow,)
+            )
+            self.evictions += overflow
+        return True
+
+    def delete(self, *keys: str) -> None:
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            generation = connection.execute(
+                "UPDATE cache_state SET generation = generation + 1 RETURNING generation"
+            ).fetchall()[0][0]
+            connection.executemany("DELETE FROM cache WHERE key = ?", [(key,) for key in keys])
+            connection.executemany(
+                "INSERT OR REPLACE INTO invalidation VALUES (?, ?)", [(key, generation) for key in keys]
+            )
+            # forget the oldest invalidations beyond max_entries, raising the floor
+            cutoff = connection.execute(
+                "SELECT generation FROM invalidation ORDER BY generation DESC LIMIT 1 OFFSET ?",
+                (self.max_entries,),
+            ).fetchone()
+            if cutoff:
+                connection.execute("DELETE FROM invalidation WHERE generation <= ?", cutoff)
+                connection.execute("UPDATE cache_state SET floor = max(floor, ?)", cutoff)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def clear(self) -> None:
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        connection.execute("DELETE FROM cache")
+        connection.execute("DELETE FROM invalidation")
+        connection.execute("UPDATE cache_state SET generation = generation + 1, floor = generation + 1")
+        connection.execute("COMMIT")
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT count(*) FROM cache").fetchone()[0]
+
+
+class ResponseCache:
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> bytes | None:
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def generation(self) -> int:
+        return self.backend.generation()
+
+    def set(self, key: str, value: bytes, since: int | None = None) -> bool:
+        return self.backend.set(key, value, since)
+
+    def invalidate(self, *keys: str) -> None:
+        if keys:
+            self.backend.delete(*keys)
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.backend.evictions,
+            "entries": len(self.backend),
+        }
@@ -0,0 +1,68 @@
+from fastapi import HTTPException
+from sqlalchemy import DDL, Table, column, event, table, text
+
+# Shortest term the trigram tokenizer can match
+MIN_TERM_LENGTH = 3
+
+
+class FullTextIndex:
+    # An external-content FTS5 table over some text columns of `source`. It stores
+    # only the index; triggers keep it in step with every write to the source table,
+    # Core executemany inserts included. Registered on the table's create/drop
+    # events, so create_all() builds it along with the table.
+    def __init__(self, source: Table, columns: list[str], weights: list[float] | None = None):
+        self.source = source
+        self.columns = columns
+        self.weights = weights
+        self.name = f"{source.name}_fts"
+        self.table = table(self.name, column("rowid"), column("rank"), column(self.name))
+        for statement in self.statements():
+            event.listen(source, "after_create", DDL(statement))
+        event.listen(source, "before_drop", DDL(f"DROP TABLE IF EXISTS {self.name}"))
+
+    def statements(self) -> list[str]:
+        name, source = self.name, self.source.name
+        names = ", ".join(self.columns)
+        new = ", ".join(f"new.{field}" for field in self.columns)
+        old = ", ".join(f"old.{field}" for field in self.columns)
+        statements = [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5("
+            f"{names}, content='{source}', content_rowid='id', tokenize='trigram')",
+            f"CREATE TRIGGER IF NOT EXISTS {name}_ai AFTER INSERT ON {source} BEGIN "
+            f"INSERT INTO {name}(rowid, {names}) VALUES (new.id, {new}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {name}_ad AFTER DELETE ON {source} BEGIN "
+            f"INSERT INTO {name}({name}, rowid, {names}) VALUES ('delete', old.id, {old}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {name}_au AFTER UPDATE OF {names} ON {source} BEGIN "
+            f"INSERT INTO {name}({name}, rowid, {names}) VALUES ('delete', old.id, {old}); "
+            f"INSERT INTO {name}(rowid, {names}) VALUES (new.id, {new}); END",
+        ]
+        if self.weights:
+            # makes rank a weighted bm25, e.g. name matches ahead of secret_name ones
+            weights = ", ".join(str(weight) for weight in self.weights)
+            statements.append(f"INSERT INTO {name}({name}, rank) VALUES ('rank', 'bm25({weights})')")
+        return statements
+
+    def create(self, connection):
+        # for databases whose source table already exists: index the current rows
+        for statement in self.statements():
+            connection.execute(text(statement))
+        connection.execute(text(f"INSERT INTO {self.name}({self.name}) VALUES ('rebuild')"))
+
+    def search(self, statement, id_column, query: str):
+        # best match first; ties keep id order so offset paging is stable
+        return (
+            statement.join(self.table, self.table.c.rowid == id_column)
+            .where(self.table.c[self.name].match(match_expression(query)))
+            .order_by(self.table.c.rank, id_column)
+        )
+
+
+def match_expression(query: str) -> str:
+    # Every whitespace separated term must occur somewhere in the indexed columns, as
+    # a substring. Terms are quoted so FTS5 operators in user input stay literal.
+    terms = query.split()
+    if not terms or any(len(term) < MIN_TERM_LENGTH for term in terms):
+        raise HTTPException(
+            status_code=400, detail=f"Search terms need at least {MIN_TERM_LENGTH} characters"
+        )
+    return " ".join('"{}"'.format(term.replace('"', '""')) for term in terms)
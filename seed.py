@@ -0,0 +1,183 @@
+"""Bulk seeding of the heroes databases.
+
+Builds benchmark datasets in a single transaction with batched executemany inserts:
+    python -m <repo>.seed --app main --heroes 1000000 --database sqlite:///bench.db
+"""
+import argparse
+import importlib
+import random
+import string
+import time
+from collections.abc import Callable, Iterable, Iterator
+from itertools import islice
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, insert
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, SQLModel, create_engine, select
+
+
+# Kept out of SQLModel.metadata: every app sharing a database file records its own row
+markers = MetaData()
+seed_marker = Table(
+    "seedmarker",
+    markers,
+    Column("app", String, primary_key=True),
+    Column("version", Integer, nullable=False),
+)
+
+
+def initialized_version(engine, app: str) -> int:
+    try:
+        with engine.connect() as connection:
+            return marker_version(connection, app)
+    except OperationalError:
+        # the marker table does not exist yet
+        return 0
+
+
+def marker_version(connection, app: str) -> int:
+    statement = select(seed_marker.c.version).where(seed_marker.c.app == app)
+    return connection.execute(statement).scalar() or 0
+
+
+def initialize(engine, app: str, version: int, setup: Callable[[Session, int], None]) -> bool:
+    # On an initialized database this is a single primary key lookup: no DDL, no seeding
+    if initialized_version(engine, app) >= version:
+        return False
+    with Session(engine) as session:
+        # Workers starting together all get here. The write lock is taken before the
+        # marker is read again, so one runs the DDL and seeding and the others wait
+        # for its commit, then find the marker and leave.
+        connection = session.connection()
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+        markers.create_all(connection)
+        current = marker_version(connection, app)
+        if current >= version:
+            session.rollback()
+            return False
+        setup(session, current)
+        session.execute(seed_marker.delete().where(seed_marker.c.app == app))
+        session.execute(seed_marker.insert().values(app=app, version=version))
+        session.commit()
+    return True
+
+
+def create_missing_indexes(connection, *tables: Table):
+    # create_all() only builds indexes together with a new table
+    for table in tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def id_generator(size: int = 6, chars: str = string.ascii_uppercase + string.digits, rng=random):
+    return "".join(rng.choices(chars, k=size))
+
+
+def insert_batched(session: Session, model, rows: Iterable[dict], batch_size: int = 10_000) -> int:
+    # a Core insert skips the ORM bulk bookkeeping, which is noticeable at millions of rows
+    statement = insert(model.__table__)
+    inserted = 0
+    rows = iter(rows)
+    while batch := list(islice(rows, batch_size)):
+        session.execute(statement, batch)
+        inserted += len(batch)
+    return inserted
+
+
+def hero_rows(
+    count: int,
+    rng: random.Random,
+    *,
+    team_ids: list[int] | None = None,
+    city_ids: list[int] | None = None,
+) -> Iterator[dict]:
+    for _ in range(count):
+        row = {
+            "name": id_generator(rng=rng),
+            "secret_name": id_generator(rng=rng),
+            "age": rng.randint(0, 100),
+        }
+        if team_ids:
+            row["team_id"] = rng.choice(team_ids)
+        if city_ids:
+            row["city_id"] = rng.choice(city_ids)
+        yield row
+
+
+def seed_main(
+    session: Session,
+    module,
+    *,
+    heroes: int,
+    teams: int = 10,
+    cities: int = 20,
+    regions: int = 5,
+    rng: random.Random,
+    batch_size: int = 10_000,
+) -> int:
+    Region, City, Team, Hero = module.Region, module.City, module.Team, module.Hero
+
+    insert_batched(session, Region, ({"name": id_generator(rng=rng)} for _ in range(regions)))
+    region_ids = session.exec(select(Region.id)).all()
+    insert_batched(
+        session,
+        City,
+        ({"name": id_generator(rng=rng), "region_id": rng.choice(region_ids)} for _ in range(cities)),
+    )
+    insert_batched(
+        session,
+        Team,
+        ({"name": id_generator(rng=rng), "headquarters": id_generator(rng=rng)} for _ in range(teams)),
+    )
+    team_ids = session.exec(select(Team.id)).all()
+    city_ids = session.exec(select(City.id)).all()
+    if heroes and not city_ids:
+        # hero.city_id is NOT NULL
+        raise ValueError("heroes need at least one city")
+    rows = hero_rows(heroes, rng, team_ids=team_ids, city_ids=city_ids)
+    return insert_batched(session, Hero, rows, batch_size)
+
+
+def seed_pagination(session: Session, module, *, heroes: int, rng: random.Random, batch_size: int = 10_000, **_) -> int:
+    return insert_batched(session, module.Hero, hero_rows(heroes, rng), batch_size)
+
+
+seeders = {"main": seed_main, "pagination": seed_pagination}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", choices=sorted(seeders), default="main")
+    parser.add_argument("--database", default="sqlite:///bench.db")
+    parser.add_argument("--heroes", type=int, default=100_000)
+    parser.add_argument("--teams", type=int, default=10)
+    parser.add_argument("--cities", type=int, default=20)
+    parser.add_argument("--regions", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    args = parser.parse_args()
+    if args.app == "main" and args.heroes and (args.cities < 1 or args.regions < 1):
+        parser.error("--app main needs --cities and --regions of at least 1: every hero lives in a city")
+
+    module = importlib.import_module(f".{args.app}", __package__)
+    engine = create_engine(args.database)
+    SQLModel.metadata.create_all(engine)
+
+    start = time.perf_counter()
+    with Session(engine) as session:
+        inserted = seeders[args.app](
+            session,
+            module,
+            heroes=args.heroes,
+            teams=args.teams,
+            cities=args.cities,
+            regions=args.regions,
+            rng=random.Random(args.seed),
+            batch_size=args.batch_size,
+        )
+        session.commit()
+    print(f"inserted {inserted} heroes in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+from typing import Any
+
+from fastapi import HTTPException
+from sqlmodel import SQLModel
+
+# A selection maps each returned field to True and each embedded relationship to
+# the selection for its rows, e.g. {"id": True, "team": {"name": True}}
+Selection = dict[str, Any]
+
+
+class Relation:
+    # A relationship a response can embed. parent_columns are the foreign keys the
+    # parent row needs loaded to resolve it, columns the ones its own rows need.
+    def __init__(
+        self,
+        attribute,
+        schema: type[SQLModel],
+        loader: str,
+        *,
+        parent_columns: tuple[str, ...] = (),
+        columns: tuple[str, ...] = (),
+        children: dict[str, "Relation"] | None = None,
+    ):
+        self.attribute = attribute
+        self.model = attribute.property.mapper.class_
+        self.schema = schema
+        self.loader = loader
+        self.parent_columns = parent_columns
+        self.columns = columns
+        self.children = children or {}
+
+
+def relation_paths(relations: dict[str, Relation], path: str = "") -> list[str]:
+    paths = []
+    for name, relation in relations.items():
+        paths.append(_join(path, name))
+        paths.extend(relation_paths(relation.children, _join(path, name)))
+    return paths
+
+
+def _split(value: str | None) -> list[str]:
+    return [part.strip() for part in (value or "").split(",") if part.strip()]
+
+
+def parse_selection(
+    schema: type[SQLModel], relations: dict[str, Relation], fields: str | None, include: str | None
+) -> Selection:
+    # include: relationship paths to embed. fields: field paths to return ("name",
+    # "team.name"); a listed field embeds the relationships on its path, and a row
+    # that is on no field path returns all of its fields. With neither, everything
+    # is embedded.
+    known = relation_paths(relations)
+    included = set(known) if include is None and fields is None else set()
+    for path in _split(include):
+        if path not in known:
+            raise HTTPException(status_code=400, detail=f"Unknown include: {path}")
+        included.add(path)
+    requested: dict[str, list[str]] = {}
+    for path in _split(fields):
+        prefix, _, name = path.rpartition(".")
+        if prefix and prefix not in known:
+            raise HTTPException(status_code=400, detail=f"Unknown field: {path}")
+        requested.setdefault(prefix, []).append(name)
+        while prefix:
+            included.add(prefix)
+            prefix = prefix.rpartition(".")[0]
+            requested.setdefault(prefix, [])
+    # embedding a nested relationship embeds the ones above it
+    for path in list(included):
+        while "." in path:
+            path = path.rpartition(".")[0]
+            included.add(path)
+    return _build(schema, relations, "", included, requested)
+
+
+def _build(schema, relations, path, included, requested) -> Selection:
+    names = requested.get(path, list(schema.model_fields))
+    for name in names:
+        if name not in schema.model_fields:
+            raise HTTPException(status_code=400, detail=f"Unknown field: {_join(path, name)}")
+    selection: Selection = dict.fromkeys(names, True)
+    for name, relation in relations.items():
+        child = _join(path, name)
+        if child in included:
+            selection[name] = _build(relation.schema, relation.children, child, included, requested)
+    return selection
+
+
+def _join(path: str, name: str) -> str:
+    return f"{path}.{name}" if path else name
+
+
+def load_columns(model, selection: Selection, relations: dict[str, Relation], *extra: str) -> list:
+    # the selected fields plus what keys, cursors and the embedded relationships need
+    names = {"id", *extra}
+    for name, value in selection.items():
+        if value is True:
+            names.add(name)
+        else:
+            names.update(relations[name].parent_columns)
+    return [getattr(model, name) for name in sorted(names)]
+
+
+def dump(row, selection: Selection) -> dict:
+    # reads only the selected attributes, so nothing unselected is loaded or encoded
+    data = {}
+    for name, value in selection.items():
+        attribute = getattr(row, name)
+        if value is True:
+            data[name] = attribute
+        elif attribute is None:
+            data[name] = None
+        elif isinstance(attribute, list):
+            data[name] = [dump(item, value) for item in attribute]
+        else:
+            data[name] = dump(attribute, value)
+    return data
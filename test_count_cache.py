@@ -0,0 +1,41 @@
+from .count_cache import CountCache
+
+
+def test_count_is_cached_until_invalidated():
+    calls = []
+    cache = CountCache()
+
+    def compute():
+        calls.append(1)
+        return len(calls)
+
+    assert cache.get("heroes", compute) == 1
+    assert cache.get("heroes", compute) == 1
+    cache.invalidate()
+    assert cache.get("heroes", compute) == 2
+
+
+def test_count_expires_after_ttl():
+    cache = CountCache(ttl=0)
+    values = iter([10, 20])
+    assert cache.get("heroes", lambda: next(values)) == 10
+    assert cache.get("heroes", lambda: next(values)) == 20
+
+
+def test_count_computed_across_an_invalidation_is_not_stored():
+    cache = CountCache()
+
+    def racing_compute():
+        # an insert commits and invalidates while the COUNT is running
+        cache.invalidate()
+        return 10
+
+    assert cache.get("heroes", racing_compute) == 10
+    assert cache.get("heroes", lambda: 11) == 11
+
+
+def test_count_is_recomputed_when_the_version_moves():
+    cache = CountCache()
+    assert cache.get("heroes", lambda: 10, version=1) == 10
+    assert cache.get("heroes", lambda: 20, version=1) == 10
+    assert cache.get("heroes", lambda: 20, version=2) == 20
@@ -1,6 +1,21 @@
+import csv
+import io
+import json
+from contextlib import contextmanager
+
+import pytest
 from fastapi.testclient import TestClient
+from pydantic import TypeAdapter
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import Session, SQLModel, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlmodel.pool import StaticPool
 
-from .main import app
+from . import main, main_async
+from .instrumentation import RequestStats, statement_shape
+from .keyset import encode_cursor
+from .main import City, Hero, Region, Team, app, get_session
 
 client = TestClient(app)
 
@@ -62,4 +77,674 @@ def test_create_existing_item():
         },
     )
     assert response.status_code == 409
-    assert response.json() == {"detail": "Item already exists"}
\ No newline at end of file
+    assert response.json() == {"detail": "Item already exists"}
+
+@pytest.fixture(name="engine")
+def engine_fixture():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    SQLModel.metadata.create_all(engine)
+    yield engine
+    SQLModel.metadata.drop_all(engine)
+
+
+@pytest.fixture(name="api")
+def api_fixture(engine):
+    def get_session_override():
+        with Session(engine) as session:
+            yield session
+
+    app.dependency_overrides[get_session] = get_session_override
+    main.response_cache.clear()
+    main.reference.invalidate()
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+@contextmanager
+def count_queries(engine, *, versions: bool = False):
+    # the ETag check's version lookup is left out unless asked for
+    statements: list[str] = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        if versions or "FROM table_version" not in statement:
+            statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def seed(engine, heroes: int, teams: int = 2):
+    with Session(engine) as session:
+        region = Region(name="Texas")
+        city = City(name="Austin", region=region)
+        db_teams = [Team(name=f"Team {i}", headquarters="HQ") for i in range(teams)]
+        session.add_all(db_teams)
+        for i in range(heroes):
+            team = db_teams[i % teams]
+            session.add(Hero(name=f"Hero {i}", secret_name="S", team=team, city=city))
+        session.commit()
+
+
+def load_reference(engine):
+    # query counts below are per request, without the one-off reference cache load
+    with Session(engine) as session:
+        main.reference.load(session)
+
+
+@pytest.mark.parametrize("url", ["/heroes/", "/teams/"])
+def test_list_query_count_does_not_grow_with_rows(engine, api, url):
+    seed(engine, heroes=2, teams=1)
+    load_reference(engine)
+    with count_queries(engine) as small_page:
+        assert api.get(url).status_code == 200
+
+    seed(engine, heroes=40, teams=10)
+    main.reference.invalidate()
+    load_reference(engine)
+    with count_queries(engine) as large_page:
+        response = api.get(url)
+    assert response.status_code == 200
+    assert len(response.json()) > 2
+    assert len(small_page) == len(large_page)
+
+
+@pytest.mark.parametrize("url", ["/heroes/1", "/teams/1"])
+def test_detail_query_count_is_fixed(engine, api, url):
+    seed(engine, heroes=20)
+    load_reference(engine)
+    with count_queries(engine) as statements:
+        assert api.get(url).status_code == 200
+    assert len(statements) <= 2
+
+
+@pytest.mark.parametrize("order_by", ["id", "name", "age"])
+def test_cursor_pages_match_offset_pages(engine, api, order_by):
+    seed(engine, heroes=7)
+    with Session(engine) as session:
+        for hero in session.exec(select(Hero)).all():
+            hero.age = None if hero.id % 3 == 0 else 30 + hero.id % 2
+            session.add(hero)
+        session.commit()
+    everything = api.get("/heroes/", params={"order_by": order_by}).json()
+
+    seen = []
+    params = {"order_by": order_by, "limit": 3}
+    while True:
+        response = api.get("/heroes/", params=params)
+        seen += response.json()
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["X-Next-Cursor"]
+
+    assert [hero["id"] for hero in seen] == [hero["id"] for hero in everything]
+
+
+def test_cursor_rejects_other_order(engine, api):
+    seed(engine, heroes=3)
+    cursor = api.get("/heroes/", params={"limit": 1}).headers["X-Next-Cursor"]
+    response = api.get("/heroes/", params={"order_by": "name", "cursor": cursor})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "values",
+    [["name", ["a"], 1], ["name", {"a": 1}, 1], ["age", True, 1], ["id", None, "1"], ["id", None, 1.5], [["id"], None, 1]],
+)
+def test_cursor_rejects_malformed_values(engine, api, values):
+    seed(engine, heroes=3)
+    order_by = values[0] if isinstance(values[0], str) else "id"
+    response = api.get("/heroes/", params={"order_by": order_by, "cursor": encode_cursor(values)})
+    assert (response.status_code, response.json()["detail"]) == (400, "Invalid cursor")
+
+
+def test_startup_seeds_once(engine, monkeypatch):
+    monkeypatch.setattr(main, "engine", engine)
+    with TestClient(app):
+        pass
+    with count_queries(engine) as statements:
+        with TestClient(app):
+            pass
+
+    assert len(statements) == 1
+    with Session(engine) as session:
+        assert len(session.exec(select(Hero)).all()) == 3
+
+
+def test_async_mode_serves_the_same_responses(tmp_path, api):
+    sync_engine = create_engine(f"sqlite:///{tmp_path / 'heroes.db'}")
+    SQLModel.metadata.create_all(sync_engine)
+    seed(sync_engine, heroes=5)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'heroes.db'}")
+
+    async def get_async_session_override():
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            yield session
+
+    def get_session_override():
+        with Session(sync_engine) as session:
+            yield session
+
+    app.dependency_overrides[get_session] = get_session_override
+    main_async.app.dependency_overrides[main_async.get_session] = get_async_session_override
+    # ETags and the delegated sync routes
+    main_async.app.dependency_overrides[get_session] = get_session_override
+    async_api = TestClient(main_async.app)
+    try:
+        urls = [
+            "/heroes/",
+            "/heroes/2",
+            "/heroes/?fields=id,name&include=team",
+            "/heroes/2?include=city.region",
+            "/teams/",
+            "/teams/1",
+            "/teams/?heroes_preview=1",
+            "/teams/1?fields=name&include=heroes",
+            "/teams/1/heroes",
+            "/heroes/search?q=Hero",
+        ]
+        for url in urls:
+            response = async_api.get(url)
+            assert (response.status_code, response.json()) == (200, api.get(url).json())
+        etag = async_api.get("/heroes/2").headers["ETag"]
+        assert etag == api.get("/heroes/2").headers["ETag"]
+        # the async routes check their ETag on the AsyncSession, without a sync session
+        sync_sessions = []
+        main_async.app.dependency_overrides[get_session] = lambda: sync_sessions.append(1)
+        assert async_api.get("/heroes/2", headers={"If-None-Match": etag}).status_code == 304
+        assert async_api.get("/teams/", headers={"If-None-Match": etag}).status_code == 200
+        assert sync_sessions == []
+        main_async.app.dependency_overrides[get_session] = get_session_override
+        assert async_api.get("/heroes/export").text == api.get("/heroes/export").text
+        assert async_api.get("/cache/stats").status_code == 200
+        bulk = async_api.post("/heroes/bulk", json=[{"name": "Bulk", "secret_name": "S", "city_id": 1}])
+        assert bulk.json() == {"ids": [6], "errors": []}
+        # async writes invalidate the response cache the sync handlers fill
+        assert api.get("/heroes/1").json()["team"] is not None
+        assert async_api.delete("/teams/1").json() == {"ok": True}
+        assert api.get("/heroes/1").json()["team"] is None
+    finally:
+        main_async.app.dependency_overrides.clear()
+
+
+def test_detail_responses_are_cached(engine, api):
+    seed(engine, heroes=2)
+    first = api.get("/heroes/1").json()
+    with count_queries(engine) as statements:
+        assert api.get("/heroes/1").json() == first
+    assert statements == []
+    assert main.response_cache.stats()["hits"] >= 1
+
+
+def test_write_during_a_cache_fill_is_not_cached_over(engine, api, monkeypatch):
+    seed(engine, heroes=1)
+    public_heroes = main.public_heroes
+
+    def rename_meanwhile(session, heroes):
+        # a PATCH from another request commits while this read builds its body
+        body = public_heroes(session, heroes)
+        with Session(engine) as other:
+            other.get(Hero, 1).name = "Renamed"
+            other.commit()
+        main.response_cache.invalidate("hero:1", "team:1")
+        return body
+
+    monkeypatch.setattr(main, "public_heroes", rename_meanwhile)
+    assert api.get("/heroes/1").json()["name"] == "Hero 0"
+    monkeypatch.setattr(main, "public_heroes", public_heroes)
+    assert api.get("/heroes/1").json()["name"] == "Renamed"
+
+
+def test_team_update_invalidates_embedding_heroes(engine, api):
+    seed(engine, heroes=2, teams=1)
+    assert api.get("/heroes/1").json()["team"]["name"] == "Team 0"
+    assert api.get("/teams/1").json()["name"] == "Team 0"
+
+    api.patch("/teams/1", json={"name": "Renamed"})
+
+    assert api.get("/heroes/1").json()["team"]["name"] == "Renamed"
+    assert api.get("/teams/1").json()["name"] == "Renamed"
+
+
+def test_hero_update_invalidates_both_teams(engine, api):
+    seed(engine, heroes=2, teams=2)
+    assert [hero["id"] for hero in api.get("/teams/1").json()["heroes"]] == [1]
+    assert [hero["id"] for hero in api.get("/teams/2").json()["heroes"]] == [2]
+
+    api.patch("/heroes/1", json={"team_id": 2})
+
+    assert api.get("/teams/1").json()["heroes"] == []
+    assert [hero["id"] for hero in api.get("/teams/2").json()["heroes"]] == [1, 2]
+    api.delete("/heroes/2")
+    assert [hero["id"] for hero in api.get("/teams/2").json()["heroes"]] == [1]
+
+
+@pytest.mark.parametrize("url", ["/heroes/", "/heroes/1", "/teams/", "/teams/1"])
+def test_not_modified_touches_no_rows(engine, api, url):
+    seed(engine, heroes=3)
+    etag = api.get(url).headers["ETag"]
+
+    with count_queries(engine, versions=True) as statements:
+        response = api.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+    # only the version counters are read
+    assert len(statements) == 1 and "FROM table_version" in statements[0]
+
+
+def test_writes_change_the_etag(engine, api):
+    seed(engine, heroes=3)
+    hero_etag = api.get("/heroes/").headers["ETag"]
+    team_etag = api.get("/teams/1").headers["ETag"]
+
+    api.patch("/teams/1", json={"headquarters": "Moon"})
+
+    response = api.get("/heroes/", headers={"If-None-Match": hero_etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != hero_etag
+    response = api.get("/teams/1", headers={"If-None-Match": team_etag})
+    assert response.json()["headquarters"] == "Moon"
+
+
+def test_writes_from_another_process_change_the_etag(engine, api):
+    seed(engine, heroes=3)
+    etag = api.get("/heroes/").headers["ETag"]
+    # e.g. another worker, or a script writing to the database file
+    with engine.begin() as connection:
+        connection.execute(text("UPDATE hero SET name = 'Renamed' WHERE id = 1"))
+
+    response = api.get("/heroes/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()[0]["name"] == "Renamed"
+
+
+def test_bulk_create_reports_errors_per_item(engine, api):
+    seed(engine, heroes=1)
+    heroes = [
+        {"name": "Bulk 1", "secret_name": "S", "city_id": 1, "team_id": 1},
+        {"name": "Missing city", "secret_name": "S"},
+        {"name": "Bulk 2", "secret_name": "S", "city_id": 1},
+    ]
+    result = api.post("/heroes/bulk", json=heroes).json()
+
+    assert result["ids"][1] is None
+    assert [error["index"] for error in result["errors"]] == [1]
+    created = [api.get(f"/heroes/{hero_id}").json() for hero_id in result["ids"] if hero_id]
+    assert [hero["name"] for hero in created] == ["Bulk 1", "Bulk 2"]
+
+
+def test_bulk_update_and_delete(engine, api):
+    seed(engine, heroes=3, teams=1)
+    assert len(api.get("/teams/1").json()["heroes"]) == 3
+
+    result = api.patch(
+        "/heroes/bulk",
+        json=[{"id": 1, "age": 99}, {"id": 2, "team_id": None, "name": "Solo"}, {"id": 42, "age": 1}],
+    ).json()
+    assert result["ids"] == [1, 2, None]
+    assert result["errors"] == [{"index": 2, "detail": "Not found"}]
+    assert api.get("/heroes/1").json()["age"] == 99
+    assert [hero["id"] for hero in api.get("/teams/1").json()["heroes"]] == [1, 3]
+
+    result = api.request("DELETE", "/teams/bulk", json=[1, 7]).json()
+    assert result["ids"] == [1, None]
+    assert api.get("/heroes/1").json()["team"] is None
+
+    result = api.request("DELETE", "/heroes/bulk", json=[1, 2]).json()
+    assert result == {"ids": [1, 2], "errors": []}
+    assert api.get("/heroes/2").status_code == 404
+
+
+def test_export_streams_every_hero(engine, api):
+    seed(engine, heroes=7)
+    with Session(engine) as session:
+        hero = session.get(Hero, 3)
+        hero.team_id = None
+        session.add(hero)
+        session.commit()
+
+    response = api.get("/heroes/export")
+    assert response.headers["content-type"] == "application/x-ndjson"
+    exported = [json.loads(line) for line in response.text.splitlines()]
+    assert exported == api.get("/heroes/").json()
+
+    exported = api.get("/heroes/export", params={"after_id": 2, "before_id": 6}).text
+    assert [json.loads(line)["id"] for line in exported.splitlines()] == [3, 4, 5]
+
+
+def test_export_csv(engine, api):
+    seed(engine, heroes=3)
+    rows = list(csv.DictReader(io.StringIO(api.get("/heroes/export?format=csv").text)))
+    assert [row["id"] for row in rows] == ["1", "2", "3"]
+    assert rows[0]["team_name"] == "Team 0"
+    assert rows[0]["region_name"] == "Texas"
+
+
+def test_import_streams_ndjson_lines(engine, api):
+    seed(engine, heroes=1)
+    api.get("/teams/1")
+    lines = [
+        json.dumps({"name": "Imported 1", "secret_name": "S", "city_id": 1, "team_id": 1}),
+        "",
+        "not json",
+        json.dumps({"name": "Imported 2", "secret_name": "S", "city_id": 1, "team_id": 9}),
+        json.dumps({"name": "Imported 3", "secret_name": "S", "city_id": 1}),
+    ]
+
+    def body():
+        for line in lines:
+            yield (line + "\n").encode()
+
+    result = api.post("/heroes/import", content=body()).json()
+
+    assert (result["received"], result["imported"], result["failed"]) == (4, 2, 2)
+    assert [error["index"] for error in result["errors"]] == [2, 3]
+    assert result["errors"][1]["detail"] == "Team not found"
+    assert [hero["name"] for hero in api.get("/teams/1").json()["heroes"]] == ["Hero 0", "Imported 1"]
+    assert api.get("/heroes/3").json()["team"] is None
+
+
+def test_import_rejects_unterminated_long_line(api):
+    response = api.post("/heroes/import", content=b"x" * (70 * 1024))
+    assert response.status_code == 413
+
+
+def hero_list_plan(engine, api, params: dict) -> list[str]:
+    # EXPLAIN QUERY PLAN of the hero SELECT that GET /heroes/ actually ran
+    executed = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        if "\nFROM hero" in statement:
+            executed.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        assert api.get("/heroes/", params=params).status_code == 200
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    statement, parameters = executed[0]
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+    return [row[-1] for row in rows]
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"name_prefix": "Hero 1"},
+        # a one-sided age range in id order is left to the planner: with LIMIT, walking
+        # the primary key until the page fills is its cheaper estimate
+        {"min_age": 20, "order_by": "age"},
+        {"min_age": 20, "max_age": 40},
+        {"min_age": 20, "max_age": 40, "order_by": "age"},
+        {"team_id": 1},
+        {"city_id": 1},
+        {"team_id": 1, "city_id": 1},
+        {"team_id": 1, "name_prefix": "Hero", "order_by": "name"},
+        {"city_id": 1, "min_age": 20, "order_by": "age"},
+    ],
+)
+def test_hero_filters_search_an_index(engine, api, params):
+    seed(engine, heroes=5)
+    plan = hero_list_plan(engine, api, params)
+    hero_steps = [step for step in plan if step.split()[1:2] == ["hero"]]
+    assert hero_steps and all(step.startswith("SEARCH hero USING") for step in hero_steps), plan
+
+
+def test_hero_filters(engine, api):
+    seed(engine, heroes=12, teams=3)
+    with Session(engine) as session:
+        for hero in session.exec(select(Hero)):
+            hero.age = hero.id * 5
+        session.commit()
+
+    def ids(**params):
+        return [hero["id"] for hero in api.get("/heroes/", params=params).json()]
+
+    assert ids(name_prefix="Hero 1") == [2, 11, 12]
+    assert ids(min_age=20, max_age=30) == [4, 5, 6]
+    assert ids(team_id=2) == [2, 5, 8, 11]
+    assert ids(team_id=2, min_age=30, order_by="age") == [8, 11]
+    assert ids(city_id=1, limit=2) == [1, 2]
+    assert ids(city_id=2) == []
+
+
+def test_name_prefix_at_the_top_of_the_code_point_range(engine, api):
+    seed(engine, heroes=1)
+    names = ["a\U0010ffff", "a\U0010ffffz", "b", "\U0010ffff\U0010ffff", "\ud7ffx", "\ue000"]
+    with Session(engine) as session:
+        session.add_all(Hero(name=name, secret_name="S", city_id=1) for name in names)
+        session.commit()
+
+    def names_for(prefix):
+        return [hero["name"] for hero in api.get("/heroes/", params={"name_prefix": prefix}).json()]
+
+    assert names_for("a\U0010ffff") == names[:2]
+    assert names_for("\U0010ffff") == names[3:4]
+    assert names_for("\ud7ff") == names[4:5]
+
+
+def test_search_ranks_name_matches_first(engine, api):
+    seed(engine, heroes=3)
+    with Session(engine) as session:
+        session.add(Hero(name="Nobody", secret_name="Spider-Boy", city_id=1))
+        session.add(Hero(name="Spider-Girl", secret_name="S", city_id=1))
+        hero = session.get(Hero, 2)
+        hero.name = "Renamed"
+        session.delete(session.get(Hero, 3))
+        session.commit()
+
+    def names(q, **params):
+        response = api.get("/heroes/search", params={"q": q, **params})
+        assert response.status_code == 200
+        return [hero["name"] for hero in response.json()]
+
+    assert names("spider") == ["Spider-Girl", "Nobody"]
+    assert names("der gir") == ["Spider-Girl"]
+    assert names("spider", offset=1) == ["Nobody"]
+    assert names("Hero") == ["Hero 0"]
+    assert names("named") == ["Renamed"]
+    assert names('"OR"') == []
+    assert api.get("/heroes/search", params={"q": "spider a"}).status_code == 400
+
+
+def test_sparse_fields_select_only_requested_columns(engine, api):
+    seed(engine, heroes=4)
+    with count_queries(engine) as statements:
+        response = api.get("/heroes/", params={"fields": "name,team.name", "include": "team"})
+    assert response.json()[0] == {"name": "Hero 0", "team": {"name": "Team 0"}}
+    assert len(statements) == 1
+    assert "secret_name" not in statements[0] and "city" not in statements[0]
+
+    assert api.get("/heroes/2", params={"fields": "id,city.region.name"}).json() == {
+        "id": 2,
+        "city": {"region": {"name": "Texas"}},
+    }
+    hero = api.get("/heroes/2", params={"include": ""}).json()
+    assert hero == {"name": "Hero 1", "secret_name": "S", "age": None, "team_id": 2, "city_id": 1, "id": 2}
+
+
+def test_sparse_team_heroes(engine, api):
+    seed(engine, heroes=4)
+    with count_queries(engine) as statements:
+        teams = api.get("/teams/", params={"fields": "name,heroes.name", "include": "heroes"}).json()
+    assert teams == [
+        {"name": "Team 0", "heroes": [{"name": "Hero 0"}, {"name": "Hero 2"}]},
+        {"name": "Team 1", "heroes": [{"name": "Hero 1"}, {"name": "Hero 3"}]},
+    ]
+    assert len(statements) == 2
+    assert not any("city" in statement for statement in statements)
+
+    team = api.get("/teams/1", params={"fields": "id,heroes.id,heroes.city.name"}).json()
+    austin = {"name": "Austin"}
+    assert team == {"id": 1, "heroes": [{"id": 1, "city": austin}, {"id": 3, "city": austin}]}
+    assert api.get("/teams/1", params={"include": "heroes.team"}).status_code == 400
+    assert api.get("/teams/1", params={"fields": "power"}).status_code == 400
+
+
+def test_team_heroes_sub_resource_pages_with_cursor(engine, api):
+    seed(engine, heroes=7, teams=2)
+    page = api.get("/teams/1/heroes", params={"limit": 2})
+    assert [hero["id"] for hero in page.json()] == [1, 3]
+    assert page.json()[0]["city"]["region"]["name"] == "Texas"
+    page = api.get("/teams/1/heroes", params={"limit": 2, "cursor": page.headers["X-Next-Cursor"]})
+    assert [hero["id"] for hero in page.json()] == [5, 7]
+    assert api.get("/teams/9/heroes").status_code == 404
+
+
+def test_team_hero_preview_and_count(engine, api):
+    seed(engine, heroes=7, teams=3)
+    load_reference(engine)
+    with count_queries(engine) as statements:
+        teams = api.get("/teams/", params={"heroes_preview": 2}).json()
+    # teams, preview heroes, counts
+    assert len(statements) == 3
+    assert [team["hero_count"] for team in teams] == [3, 2, 2]
+    assert [[hero["id"] for hero in team["heroes_preview"]] for team in teams] == [[1, 4], [2, 5], [3, 6]]
+    assert "heroes" not in teams[0]
+
+    team = api.get("/teams/1", params={"heroes_preview": 0}).json()
+    assert (team["hero_count"], team["heroes_preview"]) == (3, [])
+    assert api.get("/teams/1", params={"heroes_preview": 1, "include": ""}).status_code == 400
+
+    # both shapes are documented
+    schema = app.openapi()
+    preview = schema["components"]["schemas"]["TeamPublicWithPreview"]
+    assert {"hero_count", "heroes_preview"} <= set(preview["properties"])
+    for path in ["/teams/", "/teams/{team_id}"]:
+        assert "TeamPublicWithPreview" in json.dumps(schema["paths"][path]["get"]["responses"]["200"])
+
+
+@pytest.mark.parametrize(
+    "url, params, model",
+    [
+        ("/heroes/", {}, main.HeroPublicWithTeam),
+        ("/heroes/", {"order_by": "name", "limit": 3, "team_id": 1}, main.HeroPublicWithTeam),
+        ("/teams/", {}, main.TeamPublicWithHeroes),
+        ("/teams/", {"order_by": "name", "limit": 1}, main.TeamPublicWithHeroes),
+    ],
+)
+def test_fast_json_matches_validated_response(engine, api, monkeypatch, url, params, model):
+    seed(engine, heroes=7, teams=3)
+    with Session(engine) as session:
+        session.add(Hero(name="Loner", secret_name="S", age=30, city_id=1))
+        session.commit()
+    schema = app.openapi()
+    validated = api.get(url, params=params)
+
+    monkeypatch.setattr(main.config, "FAST_JSON", True)
+    app.openapi_schema = None
+    fast = api.get(url, params=params)
+
+    assert fast.json() == validated.json()
+    assert fast.headers.get("X-Next-Cursor") == validated.headers.get("X-Next-Cursor")
+    # nothing missing or extra compared to the documented response_model
+    adapter = TypeAdapter(list[model])
+    assert adapter.dump_python(adapter.validate_python(fast.json()), mode="json") == fast.json()
+    assert app.openapi() == schema
+
+
+def test_reads_embed_cities_from_the_reference_cache(engine, api):
+    seed(engine, heroes=3)
+    load_reference(engine)
+    with count_queries(engine) as statements:
+        heroes = api.get("/heroes/").json()
+    assert heroes[0]["city"] == {"name": "Austin", "region_id": 1, "id": 1, "region": {"name": "Texas", "id": 1}}
+    assert not any("city" in statement.split("WHERE")[0].split("FROM")[1] for statement in statements)
+
+    with Session(engine) as session:
+        session.add(City(name="Dallas", region_id=1))
+        session.add(Hero(name="Newcomer", secret_name="S", city_id=2))
+        session.commit()
+    # a city the cache has not seen triggers a reload rather than a failure
+    assert api.get("/heroes/4").json()["city"]["name"] == "Dallas"
+
+
+def test_writes_check_teams_in_the_database_and_cities_in_memory(engine, api):
+    seed(engine, heroes=1)
+    load_reference(engine)
+    with count_queries(engine) as statements:
+        response = api.post("/heroes/", json={"name": "Lost", "secret_name": "S", "city_id": 1})
+    assert response.status_code == 200
+    assert not any("FROM city" in statement for statement in statements)
+
+    # an unknown city reloads the cache once before it is rejected
+    with count_queries(engine) as statements:
+        response = api.post("/heroes/", json={"name": "Lost", "secret_name": "S", "city_id": 9})
+    assert (response.status_code, response.json()["detail"]) == (422, "City not found")
+    assert len([statement for statement in statements if "FROM city" in statement]) == 1
+    # a city the seed CLI added behind this process's back
+    with Session(engine) as session:
+        session.add(City(id=9, name="Dallas", region_id=1))
+        session.commit()
+    response = api.post("/heroes/bulk", json=[{"name": "Found", "secret_name": "S", "city_id": 9}])
+    assert response.json()["errors"] == []
+
+    response = api.patch("/heroes/1", json={"team_id": 9})
+    assert (response.status_code, response.json()["detail"]) == (422, "Team not found")
+    # a team written by another worker, behind this process's back
+    with Session(engine) as session:
+        team = Team(name="New", headquarters="HQ")
+        session.add(team)
+        session.commit()
+        team_id = team.id
+    with count_queries(engine) as statements:
+        response = api.post("/heroes/", json={"name": "Joiner", "secret_name": "S", "city_id": 1, "team_id": team_id})
+    assert response.status_code == 200
+    assert len([statement for statement in statements if "FROM team" in statement]) == 1
+
+    with Session(engine) as session:
+        session.delete(session.get(Team, team_id))
+        session.commit()
+    response = api.patch("/heroes/1", json={"team_id": team_id})
+    assert (response.status_code, response.json()["detail"]) == (422, "Team not found")
+
+
+def test_server_timing_reports_the_request_queries(engine, api):
+    seed(engine, heroes=3)
+    load_reference(engine)
+    with count_queries(engine, versions=True) as statements:
+        response = api.get("/heroes/", params={"limit": 2})
+    timing = response.headers["Server-Timing"]
+    assert f'desc="{len(statements)} queries"' in timing
+    assert 'db-1;dur=' in timing and "SELECT hero." in timing
+
+    metrics = api.get("/metrics").text
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/heroes/",le="+Inf"}' in metrics
+    assert 'db_queries_per_request_count{method="GET",route="/heroes/"}' in metrics
+    assert 'http_responses_total{method="GET",route="/heroes/",status="200"}' in metrics
+
+
+def test_slow_and_repeated_statements_are_logged(engine, api, monkeypatch, caplog):
+    seed(engine, heroes=1)
+    monkeypatch.setattr(main.config, "SLOW_QUERY_MS", 0)
+    monkeypatch.setattr(main.config, "N_PLUS_ONE_THRESHOLD", 0)
+    with caplog.at_level("WARNING"):
+        api.get("/heroes/1")
+    messages = [record.getMessage() for record in caplog.records]
+    assert any(message.startswith("Slow query") for message in messages)
+    assert any(message.startswith("Possible N+1: GET /heroes/{hero_id}") for message in messages)
+    assert statement_shape("SELECT 1 WHERE id IN (?, ?,\n ?)") == "SELECT 1 WHERE id IN (?)"
+
+
+@pytest.mark.parametrize("value", ["team=lazy", "teams=joined"])
+def test_loading_strategy_typos_fail_at_import(value):
+    with pytest.raises(ValueError, match="HEROES_LOADING"):
+        main.config._loading_strategy(value)
+    assert main.config._loading_strategy("team=selectin, heroes=joined")["heroes"] == "joined"
+
+
+def test_executemany_batches_are_not_counted_as_repeats(monkeypatch):
+    monkeypatch.setattr(main.config, "N_PLUS_ONE_THRESHOLD", 1)
+    stats = RequestStats()
+    for _ in range(3):
+        stats.record("INSERT INTO hero (name) VALUES (?)", 0.001, executemany=True)
+    assert (stats.queries, stats.repeated()) == (3, {})
+    for _ in range(2):
+        stats.record("SELECT team.id FROM team WHERE team.id = ?", 0.001)
+    assert stats.repeated() == {"SELECT team.id FROM team WHERE team.id = ?": 2}
@@ -0,0 +1,76 @@
+import subprocess
+import sys
+from pathlib import Path
+
+# main.py and pagination.py map the same hero table, so they cannot be imported into
+# one process. The checks below run in a child interpreter of their own, started by
+# the single test at the bottom.
+
+
+def make_api(heroes: int):
+    from fastapi.testclient import TestClient
+    from sqlmodel import Session, SQLModel, create_engine
+    from sqlmodel.pool import StaticPool
+
+    from . import pagination
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add_all(pagination.Hero(name=f"Hero {i}", secret_name="S", age=i) for i in range(heroes))
+        session.commit()
+    pagination.engine = engine
+    pagination.count_cache.invalidate()
+    return pagination, TestClient(pagination.app)
+
+
+def check_page_fields():
+    _, api = make_api(heroes=7)
+    first = api.get("/heroes/", params={"per-page": 3}).json()
+    assert {key: first[key] for key in ["page", "per_page", "total", "pages"]} == {
+        "page": 1,
+        "per_page": 3,
+        "total": 7,
+        "pages": 3,
+    }
+    assert [hero["id"] for hero in first["items"]] == [1, 2, 3]
+    assert first["items"][0] == {"name": "Hero 0", "secret_name": "S", "age": 0, "id": 1}
+
+    second = api.get("/heroes/", params={"per-page": 3, "cursor": first["next_cursor"]}).json()
+    assert [hero["id"] for hero in second["items"]] == [4, 5, 6]
+    last = api.get("/heroes/", params={"per-page": 3, "page": 3}).json()
+    assert ([hero["id"] for hero in last["items"]], last["next_cursor"]) == ([7], None)
+
+
+def check_writes_invalidate_cached_total():
+    from sqlmodel import Session
+
+    pagination, api = make_api(heroes=2)
+    assert api.get("/heroes/").json()["total"] == 2
+    assert api.post("/heroes/", json={"name": "New", "secret_name": "S"}).status_code == 200
+    assert api.get("/heroes/").json()["total"] == 3
+
+    # a row written by another worker moves the hero table's version
+    with Session(pagination.engine) as session:
+        session.add(pagination.Hero(name="Elsewhere", secret_name="S"))
+        session.commit()
+    assert api.get("/heroes/").json()["total"] == 4
+
+    # and an unchanged table is served from the cache
+    pagination.count_heroes = lambda session, **filters: -1
+    assert api.get("/heroes/").json()["total"] == 4
+
+
+CHECKS = [check_page_fields, check_writes_invalidate_cached_total]
+
+
+def run_checks():
+    for check in CHECKS:
+        check()
+
+
+def test_pagination_in_its_own_process():
+    code = f"from {__package__}.test_pagination import run_checks; run_checks()"
+    root = Path(__file__).resolve().parent.parent
+    result = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
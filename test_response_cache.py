@@ -0,0 +1,59 @@
+import pytest
+
+from .response_cache import LocalBackend, ResponseCache, SQLiteBackend
+
+
+def test_local_backend_evicts_least_recently_used():
+    cache = ResponseCache(LocalBackend(max_entries=2))
+    cache.set("hero:1", b"1")
+    cache.set("hero:2", b"2")
+    assert cache.get("hero:1") == b"1"
+    cache.set("hero:3", b"3")
+
+    assert cache.get("hero:2") is None
+    assert cache.get("hero:1") == b"1"
+    assert cache.stats() == {"hits": 2, "misses": 1, "evictions": 1, "entries": 2}
+
+
+def test_sqlite_backend_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "cache.db")
+    worker_a = ResponseCache(SQLiteBackend(path))
+    worker_b = ResponseCache(SQLiteBackend(path))
+
+    worker_a.set("team:1", b"{}")
+    assert worker_b.get("team:1") == b"{}"
+    worker_b.invalidate("team:1")
+    assert worker_a.get("team:1") is None
+
+
+@pytest.fixture(params=["local", "sqlite"])
+def make_backend(request, tmp_path):
+    path = str(tmp_path / "cache.db")
+    if request.param == "local":
+        return lambda **options: LocalBackend(**options)
+    return lambda **options: SQLiteBackend(path, **options)
+
+
+def test_fill_after_invalidation_is_not_stored(make_backend):
+    cache = ResponseCache(make_backend())
+    since = cache.generation()
+    # a write invalidates the key while the reader is building its body
+    cache.invalidate("hero:1")
+    assert not cache.set("hero:1", b"stale", since)
+    assert cache.get("hero:1") is None
+    # other keys, and readers that started after the write, still fill
+    assert cache.set("hero:2", b"2", since)
+    assert cache.set("hero:1", b"fresh", cache.generation())
+    assert cache.get("hero:1") == b"fresh"
+
+
+def test_forgotten_invalidations_reject_older_readers(make_backend):
+    cache = ResponseCache(make_backend(max_entries=2))
+    since = cache.generation()
+    cache.invalidate("hero:1")
+    cache.invalidate("hero:2")
+    cache.invalidate("hero:3")
+    # hero:1's invalidation is no longer remembered, so the reader cannot be trusted
+    assert not cache.set("hero:1", b"stale", since)
+    cache.clear()
+    assert not cache.set("hero:4", b"stale", cache.generation() - 1)
@@ -0,0 +1,49 @@
+import random
+import threading
+import time
+
+import pytest
+from sqlmodel import Session, SQLModel, create_engine, func, select
+from sqlmodel.pool import StaticPool
+
+from . import main
+from .engines import sqlite_engine
+from .seed import initialize, initialized_version, seed_main
+
+
+def test_concurrent_workers_initialize_once(tmp_path):
+    engine = sqlite_engine(f"sqlite:///{tmp_path / 'seed.db'}", pool_size=4)
+    calls = []
+    start = threading.Barrier(4)
+
+    def setup(session, from_version):
+        calls.append(from_version)
+        # long enough for every other worker to have read the empty marker
+        time.sleep(0.2)
+
+    def worker(results):
+        start.wait()
+        results.append(initialize(engine, "test", 1, setup))
+
+    results = []
+    threads = [threading.Thread(target=worker, args=(results,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [0]
+    assert sorted(results) == [False, False, False, True]
+    assert initialized_version(engine, "test") == 1
+    engine.dispose()
+
+
+def test_seed_main_needs_a_city_for_its_heroes():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        with pytest.raises(ValueError, match="at least one city"):
+            seed_main(session, main, heroes=3, cities=0, rng=random.Random(0))
+        session.rollback()
+        assert seed_main(session, main, heroes=3, cities=1, regions=1, rng=random.Random(0)) == 3
+        assert session.exec(select(func.count()).select_from(main.Hero)).one() == 3
@@ -0,0 +1,246 @@
+import asyncio
+import threading
+import time
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, SQLModel, create_engine, select
+from sqlmodel.pool import StaticPool
+
+from . import websocket
+from .asgi_websocket import WebSocketClient
+from .db_executor import DatabaseExecutor
+from .loop_monitor import LoopLagMonitor
+from .seed import insert_batched
+from .websocket import (
+    ConnectionManager,
+    UserActivity,
+    WebsocketMessage,
+    activity_statement,
+    update_activity,
+)
+from .write_behind import WriteBehindBuffer
+
+
+@pytest.fixture(name="engine")
+def engine_fixture():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    SQLModel.metadata.create_all(engine)
+    yield engine
+    SQLModel.metadata.drop_all(engine)
+
+
+class FakeWebSocket:
+    def __init__(self, blocked: bool = False):
+        self.sent: list[str] = []
+        self.closed_with: int | None = None
+        self.unblocked = asyncio.Event()
+        if not blocked:
+            self.unblocked.set()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        await self.unblocked.wait()
+        self.sent.append(message)
+
+    async def close(self, code: int):
+        self.closed_with = code
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def wait_for(condition, timeout: float = 5):
+    # polls instead of sleeping a fixed time, so a slow machine only takes longer
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.005)
+
+
+def test_slow_client_does_not_delay_others():
+    async def scenario():
+        manager = ConnectionManager(queue_size=10)
+        slow, fast = FakeWebSocket(blocked=True), FakeWebSocket()
+        await manager.connect(slow, 1)
+        await manager.connect(fast, 2)
+
+        await manager.broadcast("hello")
+        await settle()
+        assert fast.sent == ["hello"]
+        assert slow.sent == []
+
+        slow.unblocked.set()
+        await settle()
+        assert slow.sent == ["hello"]
+
+    asyncio.run(scenario())
+
+
+def test_slow_consumer_policies():
+    async def scenario(policy: str) -> tuple[FakeWebSocket, ConnectionManager]:
+        manager = ConnectionManager(queue_size=1, slow_consumer=policy)
+        slow = FakeWebSocket(blocked=True)
+        await manager.connect(slow, 1)
+        for message in ["a", "b", "c", "d"]:
+            await manager.broadcast(message)
+            await settle()
+        slow.unblocked.set()
+        await settle()
+        return slow, manager
+
+    # "a" is already in flight when the queue fills up
+    slow, _ = asyncio.run(scenario("drop"))
+    assert slow.sent == ["a", "b"]
+    slow, _ = asyncio.run(scenario("coalesce"))
+    assert slow.sent == ["a", "d"]
+    slow, manager = asyncio.run(scenario("disconnect"))
+    assert slow.closed_with is not None
+    assert manager.active_connections == {}
+
+
+def test_reconnect_replaces_connection():
+    async def scenario():
+        manager = ConnectionManager()
+        first, second = FakeWebSocket(), FakeWebSocket()
+        old = await manager.connect(first, 1)
+        new = await manager.connect(second, 1)
+        await manager.broadcast("hi")
+        await settle()
+        assert first.sent == []
+        assert first.closed_with is not None
+        assert second.sent == ["hi"]
+        # the replaced socket's disconnect leaves the live connection alone
+        assert not manager.disconnect(1, old)
+        assert manager.active_connections == {1: new}
+        await manager.broadcast("still here")
+        await settle()
+        assert second.sent == ["hi", "still here"]
+        assert manager.disconnect(1, new)
+        assert manager.active_connections == {}
+
+    asyncio.run(scenario())
+
+
+def test_write_behind_flushes_in_batches_and_on_stop(engine):
+    buffer = WriteBehindBuffer(engine, WebsocketMessage, max_batch=3, max_delay=60)
+
+    async def scenario():
+        buffer.start()
+        for user_id in range(5):
+            await buffer.put({"datetime": datetime.now(UTC), "user_id": user_id})
+        # the first full batch is written, the remaining two wait for max_delay
+        await wait_for(lambda: (buffer.flushes, buffer.depth) == (1, 0))
+        assert buffer.flushed_rows == 3
+        await buffer.stop()
+
+    asyncio.run(scenario())
+    assert (buffer.flushes, buffer.flushed_rows) == (2, 5)
+    with Session(engine) as session:
+        assert len(session.exec(select(WebsocketMessage)).all()) == 5
+
+
+def test_incremental_activity_matches_window_query(engine):
+    start = datetime(2025, 7, 29, 3, 0, tzinfo=UTC)
+    # heartbeats every 60s (give or take a second's fraction), a 10 minute pause,
+    # then two more heartbeats
+    offsets = [0, 60.7, 120.2, 720.9, 780.1, 840.5]
+    batches = [
+        [{"datetime": start + timedelta(seconds=s), "user_id": 5} for s in offsets[:4]],
+        [{"datetime": start + timedelta(seconds=s), "user_id": 5} for s in offsets[4:]],
+    ]
+    with Session(engine) as session:
+        for batch in batches:
+            insert_batched(session, WebsocketMessage, batch)
+            update_activity(session, batch)
+        session.commit()
+
+        incremental = session.get(UserActivity, 5)
+        full = session.exec(activity_statement(5)).one()
+        assert incremental.messages == full.messages == 6
+        assert incremental.active_seconds == full.active_seconds == 240
+
+
+def test_activity_endpoints(engine, monkeypatch):
+    start = datetime(2025, 7, 29, 3, 0, tzinfo=UTC)
+    rows = [
+        {"datetime": start + timedelta(seconds=60 * i + 0.5), "user_id": user_id}
+        for user_id, beats in [(1, 5), (2, 3)]
+        for i in range(beats)
+    ]
+    with Session(engine) as session:
+        insert_batched(session, WebsocketMessage, rows)
+        update_activity(session, rows)
+        session.commit()
+    monkeypatch.setattr(websocket, "engine", engine)
+    api = TestClient(websocket.app)
+    try:
+        activities = api.get("/activity").json()
+        assert [(a["user_id"], a["messages"], a["active_seconds"]) for a in activities] == [(1, 5, 240), (2, 3, 120)]
+        assert api.get("/activity", params={"incremental": False}).json() == activities
+        assert [a["user_id"] for a in api.get("/activity", params={"offset": 1, "limit": 1}).json()] == [2]
+
+        for incremental in [True, False]:
+            activity = api.get("/activity/2", params={"incremental": incremental}).json()
+            assert activity == activities[1]
+            response = api.get("/activity/9", params={"incremental": incremental})
+            assert (response.status_code, response.json()["detail"]) == (404, "No activity for this user")
+    finally:
+        websocket.db.shutdown()
+
+
+def test_loop_monitor_reports_blocked_intervals():
+    async def scenario():
+        monitor = LoopLagMonitor(interval=0.005, threshold=0.02)
+        monitor.start()
+        await asyncio.sleep(0.02)
+        time.sleep(0.06)
+        await asyncio.sleep(0.02)
+        await monitor.stop()
+        return monitor
+
+    monitor = asyncio.run(scenario())
+    assert monitor.blocked >= 1
+    assert monitor.max_lag >= 0.04
+
+
+def test_chat_writes_do_not_block_the_event_loop(engine, monkeypatch):
+    threads = []
+
+    def slow_flush(session, rows):
+        # a slow disk: only the executor's thread should wait for it
+        threads.append(threading.current_thread().name)
+        time.sleep(0.2)
+        update_activity(session, rows)
+
+    db = DatabaseExecutor(1, "test-db")
+    buffer = WriteBehindBuffer(engine, WebsocketMessage, max_delay=0, on_flush=slow_flush, executor=db)
+    monkeypatch.setattr(websocket, "message_buffer", buffer)
+
+    async def scenario():
+        monitor = LoopLagMonitor(interval=0.01, threshold=0.1)
+        monitor.start()
+        buffer.start()
+        client = WebSocketClient(websocket.app, "/ws/7")
+        await client.connect()
+        for _ in range(3):
+            await client.send_text("Track time")
+            assert await client.receive_text() == "You wrote: Track time"
+            await asyncio.sleep(0.05)
+        await client.close()
+        await buffer.stop()
+        await monitor.stop()
+        return monitor
+
+    monitor = asyncio.run(scenario())
+    db.shutdown()
+    assert monitor.blocked == 0
+    assert threads and all(name.startswith("test-db") for name in threads)
+    with Session(engine) as session:
+        assert session.get(UserActivity, 7).messages == 3
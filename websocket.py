@@ -1,36 +1,155 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Literal
+
+from fastapi import FastAPI, HTTPException, Query, WebSocket, WebSocketDisconnect, status
 from fastapi.responses import HTMLResponse
 
-from sqlmodel import SQLModel, create_engine, Session, Field
+from sqlalchemy import Index, Integer, case, cast, insert
+from sqlmodel import SQLModel, Session, Field, col, func, select
 from datetime import datetime, UTC
 
-app = FastAPI()
+from . import config
+from .db_executor import DatabaseExecutor
+from .engines import sqlite_engine
+from .instrumentation import instrument
+from .loop_monitor import LoopLagMonitor
+from .seed import create_missing_indexes, initialize
+from .write_behind import WriteBehindBuffer
+
+SlowConsumerPolicy = Literal["drop", "coalesce", "disconnect"]
 
 sqlite_file_name = "database.db"
 sqlite_url = f"sqlite:///{sqlite_file_name}"
 
-connect_args = {"check_same_thread": False}
-engine = create_engine(sqlite_url, echo=True, connect_args=connect_args)
+# Every statement runs on db's threads, never on the event loop, so a connection per
+# thread is enough. The write-behind task is the only writer; the rest serve the
+# activity endpoints.
+engine = sqlite_engine(sqlite_url, pool_size=config.WEBSOCKET_DB_THREADS)
+db = DatabaseExecutor(config.WEBSOCKET_DB_THREADS, "websocket-db")
 
 
-def get_session():
-    with Session(engine) as session:
-        yield session
+class WebsocketMessage(SQLModel, table=True):
+    __table_args__ = (Index("ix_websocketmessage_user_id_datetime", "user_id", "datetime"),)
 
+    id: int | None = Field(default=None, primary_key=True)
+    datetime: datetime
+    user_id: int
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
 
+# Two messages closer than this count as continuous activity; the client sends a
+# "Track time" heartbeat every 60 seconds. Gaps are counted in whole seconds, so the
+# window query and the incremental rollup add up exactly the same numbers.
+ACTIVITY_GAP_SECONDS = 65
 
-class WebsocketMessage(SQLModel, table=True):
-    id: int | None = Field(default=None, primary_key=True)
-    datetime: datetime
+
+class UserActivityBase(SQLModel):
+    active_seconds: float = 0
+    messages: int = 0
+    last_seen: datetime | None = None
+
+
+class UserActivity(UserActivityBase, table=True):
+    user_id: int = Field(primary_key=True)
+
+
+class UserActivityPublic(UserActivityBase):
     user_id: int
 
 
-@app.on_event("startup")
-def on_startup():
-    create_db_and_tables()
+def epoch_seconds(value):
+    return cast(func.strftime("%s", value), Integer)
+
+
+def activity_statement(user_id: int | None = None):
+    previous = func.lag(WebsocketMessage.datetime).over(
+        partition_by=WebsocketMessage.user_id, order_by=WebsocketMessage.datetime
+    )
+    gaps = select(
+        WebsocketMessage.user_id,
+        WebsocketMessage.datetime,
+        (epoch_seconds(WebsocketMessage.datetime) - epoch_seconds(previous)).label("gap"),
+    )
+    if user_id is not None:
+        gaps = gaps.where(WebsocketMessage.user_id == user_id)
+    gaps = gaps.subquery()
+    active = func.sum(case((gaps.c.gap < ACTIVITY_GAP_SECONDS, gaps.c.gap), else_=0))
+    return (
+        select(
+            gaps.c.user_id,
+            active.label("active_seconds"),
+            func.count().label("messages"),
+            func.max(gaps.c.datetime).label("last_seen"),
+        )
+        .group_by(gaps.c.user_id)
+        .order_by(gaps.c.user_id)
+    )
+
+
+def rebuild_activity(session: Session):
+    session.execute(UserActivity.__table__.delete())
+    columns = ["user_id", "active_seconds", "messages", "last_seen"]
+    session.execute(insert(UserActivity.__table__).from_select(columns, activity_statement()))
+
+
+def as_utc(value: datetime) -> datetime:
+    # timestamps are stored as naive UTC; the driver may hand them back either way
+    return value if value.tzinfo else value.replace(tzinfo=UTC)
+
+
+def update_activity(session: Session, rows: list[dict]):
+    # Runs in the write-behind transaction, so the rollup always matches the flushed
+    # messages. Rows older than a user's last_seen only bump the message count.
+    rows = sorted(rows, key=lambda row: row["datetime"])
+    user_ids = {row["user_id"] for row in rows}
+    statement = select(UserActivity).where(col(UserActivity.user_id).in_(user_ids))
+    rollups = {activity.user_id: activity for activity in session.exec(statement)}
+    for row in rows:
+        activity = rollups.get(row["user_id"])
+        if activity is None:
+            activity = rollups[row["user_id"]] = UserActivity(user_id=row["user_id"])
+            session.add(activity)
+        seen = as_utc(row["datetime"])
+        last_seen = activity.last_seen and as_utc(activity.last_seen)
+        if last_seen is not None and seen >= last_seen:
+            gap = (seen.replace(microsecond=0) - last_seen.replace(microsecond=0)).total_seconds()
+            if gap < ACTIVITY_GAP_SECONDS:
+                activity.active_seconds += gap
+        if last_seen is None or seen > last_seen:
+            activity.last_seen = seen
+        activity.messages += 1
+
+
+SCHEMA_VERSION = 3
+
+
+def setup_database(session: Session, from_version: int):
+    connection = session.connection()
+    SQLModel.metadata.create_all(connection)
+    if from_version < 2:
+        create_missing_indexes(connection, WebsocketMessage.__table__)
+    if from_version < 3:
+        # rollups from before gaps were counted in whole seconds
+        rebuild_activity(session)
+
+
+message_buffer = WriteBehindBuffer(engine, WebsocketMessage, on_flush=update_activity, executor=db)
+loop_monitor = LoopLagMonitor(threshold=config.LOOP_LAG_THRESHOLD_MS / 1000)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    initialize(engine, "websocket", SCHEMA_VERSION, setup_database)
+    message_buffer.start()
+    loop_monitor.start()
+    yield
+    await message_buffer.stop()
+    await loop_monitor.stop()
+    db.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+metrics = instrument(app)
 
 
 html = """
@@ -81,26 +200,94 @@ html = """
 """
 
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
+class Connection:
+    def __init__(self, websocket: WebSocket, queue_size: int):
+        self.websocket = websocket
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=queue_size)
+        self.writer: asyncio.Task | None = None
+        self.dropped = 0
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+class ConnectionManager:
+    # Broadcasts only enqueue: every connection has its own bounded queue drained by
+    # a writer task, so one slow client never delays delivery to the others.
+    # slow_consumer decides what happens when a client's queue is full:
+    # "drop" discards the new message, "coalesce" replaces the backlog with the
+    # newest message, "disconnect" closes the client.
+    def __init__(self, queue_size: int = 100, slow_consumer: SlowConsumerPolicy = "drop"):
+        self.queue_size = queue_size
+        self.slow_consumer = slow_consumer
+        self.active_connections: dict[int, Connection] = {}
+        self._closing: set[asyncio.Task] = set()
+
+    async def connect(self, websocket: WebSocket, client_id: int) -> Connection:
+        await websocket.accept()
+        # a reconnect with the same id replaces the previous socket, which is closed
+        replaced = self.active_connections.get(client_id)
+        if replaced and self.disconnect(client_id, replaced):
+            self._close_later(replaced.websocket, status.WS_1000_NORMAL_CLOSURE)
+        connection = Connection(websocket, self.queue_size)
+        connection.writer = asyncio.create_task(self._write(client_id, connection))
+        self.active_connections[client_id] = connection
+        return connection
+
+    def disconnect(self, client_id: int, connection: Connection | None = None) -> bool:
+        # with a connection, only that one: a replaced socket going away must not
+        # take the client's current connection with it
+        current = self.active_connections.get(client_id)
+        if current is None or (connection is not None and current is not connection):
+            return False
+        del self.active_connections[client_id]
+        if current.writer is not asyncio.current_task():
+            current.writer.cancel()
+        return True
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
         await websocket.send_text(message)
 
     async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
-
-
-manager = ConnectionManager()
+        for client_id, connection in list(self.active_connections.items()):
+            self._enqueue(client_id, connection, message)
+
+    def _enqueue(self, client_id: int, connection: Connection, message: str):
+        try:
+            connection.queue.put_nowait(message)
+            return
+        except asyncio.QueueFull:
+            connection.dropped += 1
+        if self.slow_consumer == "coalesce":
+            while not connection.queue.empty():
+                connection.queue.get_nowait()
+            connection.queue.put_nowait(message)
+        elif self.slow_consumer == "disconnect":
+            if self.disconnect(client_id, connection):
+                self._close_later(connection.websocket, status.WS_1013_TRY_AGAIN_LATER)
+
+    async def _write(self, client_id: int, connection: Connection):
+        try:
+            while True:
+                message = await connection.queue.get()
+                await connection.websocket.send_text(message)
+        except Exception:
+            # the socket is gone; the endpoint's receive loop reports the disconnect
+            self.disconnect(client_id, connection)
+
+    def _close_later(self, websocket: WebSocket, code: int):
+        # held until done, so the task is not garbage collected mid-close
+        task = asyncio.create_task(self._close(websocket, code))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close(self, websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except RuntimeError:
+            pass
+
+
+manager = ConnectionManager(
+    queue_size=config.BROADCAST_QUEUE_SIZE, slow_consumer=config.SLOW_CONSUMER_POLICY
+)
 
 
 @app.get("/")
@@ -108,64 +295,66 @@ async def get():
     return HTMLResponse(html)
 
 
+@app.get("/stats")
+async def stats():
+    return {
+        "write_behind_depth": message_buffer.depth,
+        "write_behind_flushes": message_buffer.flushes,
+        "write_behind_flushed_rows": message_buffer.flushed_rows,
+        "write_behind_failed_rows": message_buffer.failed_rows,
+        **loop_monitor.stats(),
+    }
+
+
+def list_activities(session: Session, incremental: bool, offset: int, limit: int):
+    if incremental:
+        statement = select(UserActivity).order_by(UserActivity.user_id)
+        return session.exec(statement.offset(offset).limit(limit)).all()
+    return session.exec(activity_statement().offset(offset).limit(limit)).all()
+
+
+def get_activity(session: Session, user_id: int, incremental: bool):
+    # incremental answers from the rollup table; otherwise the window query runs over
+    # this user's messages, an index range scan on (user_id, datetime)
+    if incremental:
+        return session.get(UserActivity, user_id)
+    return session.exec(activity_statement(user_id)).first()
+
+
+@app.get("/activity", response_model=list[UserActivityPublic])
+async def read_activities(
+    *,
+    incremental: bool = True,
+    offset: int = 0,
+    limit: int = Query(default=100, le=100),
+):
+    return await db.run_session(engine, list_activities, incremental, offset, limit)
+
+
+@app.get("/activity/{user_id}", response_model=UserActivityPublic)
+async def read_activity(*, user_id: int, incremental: bool = True):
+    activity = await db.run_session(engine, get_activity, user_id, incremental)
+    if not activity:
+        raise HTTPException(status_code=404, detail="No activity for this user")
+    return activity
+
+
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: int):
-    await manager.connect(websocket)
+    connection = await manager.connect(websocket, client_id)
     try:
 
         while True:
             data = await websocket.receive_text()
 
-            session = next(get_session())
-
-            model_db = WebsocketMessage(datetime=datetime.now(UTC), user_id=client_id)
-            session.add(model_db)
-            session.commit()
+            await message_buffer.put({"datetime": datetime.now(UTC), "user_id": client_id})
 
             await manager.send_personal_message(f"You wrote: {data}", websocket)
             # await manager.broadcast(f"Client #{client_id} says: {data}")
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
-        await manager.broadcast(f"Client #{client_id} left the chat")
-
-
-# WORKS!!!
-# select sum(case when age(datetime,lag) < interval '65 second' then age(datetime,lag) end) as interval from (
-# 	SELECT  *, lag(w.datetime,1 )
-# 	OVER(ORDER By w.datetime)
-# 	as lag
-# 	FROM  websocketmessage w
-# 	where user_id = 5
-# )
-# {"minutes":24,"seconds":59,"milliseconds":998.457}
-
-
-# select datetime, lag from (
-# 	SELECT  *, lag(w.datetime,1 )
-# 	OVER(ORDER By w.datetime)
-# 	as lag
-# 	FROM  websocketmessage w
-# 	where user_id = 5
-# )
-
-
-# select datetime, lag, age(datetime,lag) from (
-# 	SELECT  *, lag(w.datetime,1 )
-# 	OVER(ORDER By w.datetime)
-# 	as lag
-# 	FROM  websocketmessage w
-# 	where user_id = 5
-# )
-
-
-# select sum(age(datetime,lag)) from (
-# 	SELECT  *, lag(w.datetime,1 )
-# 	OVER(ORDER By w.datetime)
-# 	as lag
-# 	FROM  websocketmessage w
-# 	where user_id = 5
-# ) LIMIT 100
-# {"minutes":26,"seconds":52,"milliseconds":999.93}
+        # a socket replaced by a reconnect leaves quietly: the client is still here
+        if manager.disconnect(client_id, connection):
+            await manager.broadcast(f"Client #{client_id} left the chat")
 
 
 # CREATE TABLE websocketmessage(
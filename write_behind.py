@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from collections.abc import Callable
+
+from sqlmodel import Session
+
+from .db_executor import DatabaseExecutor
+from .seed import insert_batched
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    # Rows are queued on the event loop and written by a background task in batches:
+    # one executemany transaction per max_batch rows or max_delay seconds, whichever
+    # comes first, run on a worker thread so the loop never waits on an fsync: the
+    # executor's when one is given, else the default one of asyncio.to_thread.
+    # on_flush runs in the same transaction, e.g. to maintain rollups of the rows.
+    def __init__(
+        self,
+        engine,
+        model,
+        *,
+        max_batch: int = 500,
+        max_delay: float = 0.5,
+        max_queue: int = 10_000,
+        on_flush: Callable[[Session, list[dict]], None] | None = None,
+        executor: DatabaseExecutor | None = None,
+    ):
+        self.engine = engine
+        self.model = model
+        self.on_flush = on_flush
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.failed_rows = 0
+        self._queue: asyncio.Queue[dict | None] | None = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run())
+
+    async def put(self, row: dict):
+        # waits when the queue is full, which pushes back on the sending socket
+        await self._queue.put(row)
+
+    async def stop(self):
+        # the sentinel is queued behind every pending row, so they are all flushed
+        await self._queue.put(None)
+        await self._task
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            row = await self._queue.get()
+            if row is None:
+                break
+            batch = [row]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    row = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        row = await asyncio.wait_for(self._queue.get(), timeout)
+                    except TimeoutError:
+                        break
+                if row is None:
+                    stopping = True
+                    break
+                batch.append(row)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[dict]):
+        try:
+            if self.executor:
+                await self.executor.run(self._write, batch)
+            else:
+                await asyncio.to_thread(self._write, batch)
+        except Exception:
+            self.failed_rows += len(batch)
+            logger.exception("Dropped %d buffered %s rows", len(batch), self.model.__name__)
+        else:
+            self.flushes += 1
+            self.flushed_rows += len(batch)
+
+    def _write(self, batch: list[dict]):
+        with Session(self.engine) as session:
+            insert_batched(session, self.model, batch)
+            if self.on_flush:
+                self.on_flush(session, batch)
+            session.commit()